@@ -1 +1,6 @@
+#ifndef ALL_H
+#define ALL_H
+
 #include "w.h"
+
+#endif
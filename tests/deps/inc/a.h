@@ -0,0 +1 @@
+#include "b.h"
@@ -0,0 +1 @@
+#define VALUE 1
@@ -0,0 +1,3 @@
+#include "a.h"
+
+int main() { return VALUE - 1; }
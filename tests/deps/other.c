@@ -0,0 +1 @@
+int other() { return 0; }
@@ -0,0 +1,70 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Compare the hash functions available for the signatures (waf configure --hash=...)
+on a project created by genbench.py:
+
+	./hashbench.py ../waf /tmp/hashbench 50 100 15 5
+
+For each hash function, the project is configured and built once, then the following are measured:
+
+* null build: nothing to do, the file hashes are obtained from the build cache
+* touched build: all the files are touched, so that they must be hashed again (nothing is recompiled)
+"""
+
+import os, sys, time, subprocess
+
+HASHES = ['md5', 'blake2b', 'xxhash']
+RUNS = 5
+
+def run(cmd, cwd):
+	t1 = time.time()
+	ret = subprocess.call(cmd, cwd=cwd, stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+	if ret:
+		raise ValueError('command %r failed' % cmd)
+	return time.time() - t1
+
+def touch_all(path):
+	# the file hashes are not cached for files modified in the last seconds (Build.HASH_DELAY)
+	stamp = time.time() - 60
+	for (dirpath, dirnames, filenames) in os.walk(path):
+		if 'build' in dirnames:
+			dirnames.remove('build')
+		for x in filenames:
+			if x.endswith('.cpp') or x.endswith('.h'):
+				os.utime(os.path.join(dirpath, x), (stamp, stamp))
+
+def best(cmd, cwd, prepare=None):
+	lst = []
+	for i in range(RUNS):
+		if prepare:
+			prepare()
+		lst.append(run(cmd, cwd))
+	return min(lst)
+
+if __name__ == '__main__':
+	if len(sys.argv) < 3:
+		print('Usage: %s waf_path project_dir [libs classes internal external]' % sys.argv[0])
+		sys.exit(1)
+
+	waf = os.path.abspath(sys.argv[1])
+	path = os.path.abspath(sys.argv[2])
+	args = sys.argv[3:] or ['50', '100', '15', '5']
+
+	if not os.path.exists(path):
+		genbench = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'genbench.py')
+		subprocess.check_call([sys.executable, genbench, path] + args)
+	touch_all(path)
+
+	print('%-10s %12s %12s' % ('hash', 'null build', 'touched'))
+	for name in HASHES:
+		try:
+			run([sys.executable, waf, 'distclean', 'configure', '--hash=%s' % name], path)
+		except ValueError:
+			print('%-10s %12s %12s' % (name, '-', '-'))
+			continue
+		run([sys.executable, waf, 'build'], path)
+		null = best([sys.executable, waf, 'build'], path)
+		touched = best([sys.executable, waf, 'build'], path, lambda: touch_all(path))
+		print('%-10s %11.3fs %11.3fs' % (name, null, touched))
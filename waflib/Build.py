@@ -9,7 +9,7 @@ The inheritance tree is the following:
 
 """
 
-import os, sys, errno, re, shutil
+import os, sys, errno, re, shutil, stat, time, io
 try:
 	import cPickle
 except ImportError:
@@ -29,12 +29,59 @@ INSTALL = 1337
 UNINSTALL = -1337
 """Negative value '<-' uninstall, see :py:attr:`waflib.Build.BuildContext.is_install`"""
 
-SAVED_ATTRS = 'root node_deps raw_deps task_sigs'.split()
-"""Build class members to save between the runs (root, node_deps, raw_deps, task_sigs)"""
+SAVED_ATTRS = 'root node_deps raw_deps task_sigs task_durations file_hashes'.split()
+"""Build class members to save between the runs (root, node_deps, raw_deps, task_sigs, task_durations, file_hashes)"""
+
+JOURNAL = True
+"""
+Store the build data in an append-only journal, see :py:meth:`waflib.Build.BuildContext.store_journal`.
+When False, the data is pickled into a single file which is rewritten after each build.
+"""
+
+JOURNAL_SUFFIX = '.journal'
+"""Suffix added to :py:const:`waflib.Context.DBFILE` for the journal file"""
+
+LEGACY_DBFILE = '.wafpickle-%s-%d-%d' % (sys.platform, sys.hexversion, 98)
+"""Build data file of the previous format (pickled node objects), converted once by :py:meth:`waflib.Build.BuildContext.restore_legacy`"""
+
+COMPACT_RATIO = 2
+"""The journal is compacted when it becomes this many times larger than after the previous compaction"""
+
+MANIFEST_SUFFIX = '.manifest'
+"""Suffix added to :py:const:`waflib.Context.DBFILE` for the build manifest, see :py:meth:`waflib.Build.BuildContext.check_manifest`"""
+
+GRAPH_SUFFIX = '.graph'
+"""Suffix added to :py:const:`waflib.Context.DBFILE` for the task graph, see :py:meth:`waflib.Build.BuildContext.load_graph`"""
+
+PRUNE = True
+"""Remove the entries of the tasks that no longer exist at the end of the full builds, see :py:meth:`waflib.Build.BuildContext.prune`"""
+
+HASH_DELAY = 2
+"""
+The hashes of files modified less than ``HASH_DELAY`` seconds before they are read are not stored
+in :py:attr:`waflib.Build.BuildContext.file_hashes`, as a modification within the timestamp resolution would not be detected
+"""
 
 CFG_FILES = 'cfg_files'
 """Files from the build directory to hash before starting the build (``config.h`` written during the configuration)"""
 
+def copy_table(dct):
+	"""
+	Copy a table of the build data for :py:meth:`waflib.Build.BuildContext.store_journal`; the list and dict
+	values are copied too, so that the changes made in place (``bld.node_deps[key].append(node)``) are detected
+
+	:param dct: table
+	:type dct: dict
+	:rtype: dict
+	"""
+	ret = dict(dct)
+	for (k, v) in dct.items():
+		if isinstance(v, list):
+			ret[k] = list(v)
+		elif isinstance(v, dict):
+			ret[k] = dict(v)
+	return ret
+
 POST_AT_ONCE = 0
 """Post mode: all task generators are posted before the build really starts"""
 
@@ -85,6 +132,36 @@ class BuildContext(Context.Context):
 		self.raw_deps = {}
 		"""Dict of custom data returned by :py:meth:`waflib.Task.Task.scan` (persists between build executions)"""
 
+		self.deps_pending = {}
+		"""Journal records of the dependency shards not loaded yet, see :py:meth:`waflib.Build.BuildContext.load_deps`"""
+
+		self.deps_loaded = set()
+		"""Dependency shards loaded"""
+
+		self.deps_shard = {}
+		"""Shard of the entries in node_deps and raw_deps"""
+
+		self.task_durations = {}
+		"""Execution times of the tasks in seconds, keyed by :py:meth:`waflib.Task.Task.uid` (persists between build executions)"""
+
+		self.file_hashes = {}
+		"""File hashes keyed by absolute path, along with the file status used to detect changes, see :py:meth:`waflib.Build.BuildContext.hash_file` (persists between build executions)"""
+
+		self.file_hashes_dirty = False
+		"""Set when new values are added to :py:attr:`waflib.Build.BuildContext.file_hashes`, to save the build cache even if no task was executed"""
+
+		self.hashed_files = set()
+		"""Paths given to :py:meth:`waflib.Build.BuildContext.hash_file` during the build"""
+
+		self.listed_dirs = set()
+		"""Folders listed while reading the scripts, see :py:meth:`waflib.Build.BuildContext.store_graph`"""
+
+		self.graph_groups = None
+		"""Lists of tasks restored by :py:meth:`waflib.Build.BuildContext.load_graph`"""
+
+		self.graph_files = None
+		"""Files checked by :py:meth:`waflib.Build.BuildContext.load_graph`"""
+
 		# list of folders that are already scanned
 		# so that we do not need to stat them one more time
 		self.cache_dir_contents = {}
@@ -94,11 +171,23 @@ class BuildContext(Context.Context):
 		self.launch_dir = Context.launch_dir
 
 		self.jobs = Options.options.jobs
+		self.jobs_auto = Options.options.jobs_auto
 		self.targets = Options.options.targets
 		self.keep = Options.options.keep
 		self.cache_global = Options.cache_global
 		self.nocache = Options.options.nocache
+		self.cache_codec = Options.options.cache_codec
+		if Options.options.cache_links and not Utils.is_win32:
+			Task.CACHE_LINKS = True
+		self.cache_async = Options.options.cache_async
 		self.progress_bar = Options.options.progress_bar
+		self.critical_path = Options.options.critical_path
+		self.pipeline = Options.options.pipeline
+		self.manifest = Options.options.manifest
+		self.task_graph = Options.options.task_graph
+
+		self.resources = {}
+		"""Capacity of the resource pools used by the tasks (:py:attr:`waflib.Task.TaskBase.resources`), the default capacity is the amount of jobs"""
 
 		############ stuff below has not been reviewed
 
@@ -241,6 +330,11 @@ class BuildContext(Context.Context):
 		"""
 		Restore the data from previous builds and call :py:meth:`waflib.Build.BuildContext.execute_build`. Overrides from :py:func:`waflib.Context.Context.execute`
 		"""
+		if self.check_manifest():
+			Logs.info("Waf: Entering directory `%s'" % self.variant_dir)
+			Logs.info("Waf: Leaving directory `%s'" % self.variant_dir)
+			return
+
 		self.restore()
 		if not self.all_envs:
 			self.load_envs()
@@ -258,8 +352,9 @@ class BuildContext(Context.Context):
 		"""
 
 		Logs.info("Waf: Entering directory `%s'" % self.variant_dir)
-		self.recurse([self.run_dir])
-		self.pre_build()
+		if not self.load_graph():
+			self.recurse([self.run_dir])
+			self.pre_build()
 
 		# display the time elapsed in the progress bar
 		self.timer = Utils.Timer()
@@ -291,8 +386,43 @@ class BuildContext(Context.Context):
 				raise Errors.WafError('Version mismatch! reconfigure the project')
 			for t in env['tools']:
 				self.setup(**t)
+			Utils.set_hash(env['hash'] or 'md5')
 
 		dbfn = os.path.join(self.variant_dir, Context.DBFILE)
+		if JOURNAL:
+			found = self.restore_journal(dbfn + JOURNAL_SUFFIX)
+		else:
+			found = self.restore_pickle(dbfn)
+
+		self.init_dirs()
+		if found:
+			return
+
+		# one-shot conversion of the data written in another format
+		if JOURNAL and os.path.isfile(dbfn):
+			# pickle file written with JOURNAL = False
+			old = dbfn
+			found = self.restore_pickle(old)
+		else:
+			old = os.path.join(self.variant_dir, LEGACY_DBFILE)
+			found = os.path.isfile(old) and self.restore_legacy(old)
+		if found:
+			self.init_dirs()
+			self.store()
+			try:
+				os.remove(old)
+			except OSError:
+				pass
+
+	def restore_pickle(self, dbfn):
+		"""
+		Load the data from a pickle file written by :py:meth:`waflib.Build.BuildContext.store_pickle`
+
+		:param dbfn: file path
+		:type dbfn: string
+		:return: True if the data could be used
+		:rtype: bool
+		"""
 		try:
 			data = Utils.readf(dbfn, 'rb')
 		except (IOError, EOFError):
@@ -307,22 +437,74 @@ class BuildContext(Context.Context):
 				except Exception as e:
 					Logs.debug('build: Could not pickle the build cache %s: %r' % (dbfn, e))
 				else:
-					for x in SAVED_ATTRS:
-						setattr(self, x, data[x])
+					if data.get('hash', 'md5') != Utils.hash_name:
+						# the signatures cannot be compared
+						Logs.debug('build: Discarding the build cache %s (hash function changed)' % dbfn)
+					else:
+						self.load_tree(data['root'])
+						for x in SAVED_ATTRS:
+							if x != 'root':
+								setattr(self, x, data[x])
+						self.node_deps = self.decode_node_deps(self.node_deps)
+						return True
 			finally:
 				waflib.Node.pickle_lock.release()
+		return False
 
-		self.init_dirs()
+	def restore_legacy(self, dbfn):
+		"""
+		Load the data written by the previous releases (:py:const:`waflib.Build.LEGACY_DBFILE`), in which
+		the node objects were pickled, so that the build directories are not rebuilt from scratch after an upgrade
+
+		:param dbfn: file path
+		:type dbfn: string
+		:return: True if the data could be used
+		:rtype: bool
+		"""
+		if Utils.hash_name != 'md5':
+			# the signatures cannot be compared
+			return False
+		try:
+			data = Utils.readf(dbfn, 'rb')
+		except (IOError, OSError):
+			return False
+		try:
+			waflib.Node.pickle_lock.acquire()
+			waflib.Node.Nod3 = self.node_class
+			try:
+				data = cPickle.loads(data)
+			except Exception as e:
+				Logs.debug('build: Could not pickle the build cache %s: %r' % (dbfn, e))
+				return False
+		finally:
+			waflib.Node.pickle_lock.release()
+		for x in ('root', 'node_deps', 'raw_deps', 'task_sigs'):
+			setattr(self, x, data[x])
+		return True
 
 	def store(self):
 		"""
-		Store the data for next runs, sets the attributes listed in :py:const:`waflib.Build.SAVED_ATTRS`. Uses a temporary
+		Store the data for next runs, sets the attributes listed in :py:const:`waflib.Build.SAVED_ATTRS`,
+		see :py:meth:`waflib.Build.BuildContext.store_journal` and :py:meth:`waflib.Build.BuildContext.store_pickle`
+		"""
+		if JOURNAL:
+			self.store_journal()
+		else:
+			self.store_pickle()
+
+	def store_pickle(self):
+		"""
+		Store the data for next runs into a single pickle file. Uses a temporary
 		file to avoid problems on ctrl+c.
 		"""
 
-		data = {}
+		(tree, index) = self.dump_tree()
+		data = {'hash': Utils.hash_name, 'root': tree}
 		for x in SAVED_ATTRS:
-			data[x] = getattr(self, x)
+			if x == 'node_deps':
+				data[x] = dict((k, self.encode_nodes(v, index)) for (k, v) in self.node_deps.items())
+			elif x != 'root':
+				data[x] = getattr(self, x)
 		db = os.path.join(self.variant_dir, Context.DBFILE)
 
 		try:
@@ -332,7 +514,18 @@ class BuildContext(Context.Context):
 		finally:
 			waflib.Node.pickle_lock.release()
 
-		Utils.writef(db + '.tmp', x, m='wb')
+		self.replace_db(db, x)
+
+	def replace_db(self, db, data):
+		"""
+		Replace a database file by writing a temporary file first, and by renaming it
+
+		:param db: file path
+		:type db: string
+		:param data: file contents
+		:type data: bytes
+		"""
+		Utils.writef(db + '.tmp', data, m='wb')
 
 		try:
 			st = os.stat(db)
@@ -345,6 +538,720 @@ class BuildContext(Context.Context):
 		# do not use shutil.move (copy is not thread-safe)
 		os.rename(db + '.tmp', db)
 
+	def dump_tree(self, sig_root=None):
+		"""
+		Flatten the node tree into arrays instead of pickling the node objects, see :py:func:`waflib.Node.dump_tree`
+
+		:param sig_root: store the signatures of the nodes under this folder only (all if None)
+		:type sig_root: :py:class:`waflib.Node.Node`
+		:return: the serializable data and a dict mapping the nodes to their indices
+		:rtype: tuple
+		"""
+		return waflib.Node.dump_tree(self.root, sig_root, getattr(self, 'node_tree', None))
+
+	def load_tree(self, data):
+		"""
+		Restore the node tree written by :py:meth:`waflib.Build.BuildContext.dump_tree`, the node objects
+		are only created for the folders visited during the build (:py:class:`waflib.Node.CompactTree`)
+
+		:param data: serialized data
+		:type data: tuple
+		"""
+		self.node_tree = waflib.Node.load_tree(self.root, data)
+
+	def encode_nodes(self, lst, index):
+		"""
+		Nodes are written as indices in the flattened tree, or as absolute paths when not found in the tree
+
+		:param lst: nodes
+		:type lst: list of :py:class:`waflib.Node.Node`
+		:param index: dict returned by :py:meth:`waflib.Build.BuildContext.dump_tree`
+		:type index: dict
+		:rtype: list of int or string
+		"""
+		ret = []
+		for x in lst:
+			try:
+				ret.append(index[x])
+			except KeyError:
+				ret.append(x.abspath())
+		return ret
+
+	def decode_node_deps(self, deps):
+		"""
+		Replace the indices and the paths written by :py:meth:`waflib.Build.BuildContext.encode_nodes` by nodes
+
+		:param deps: dict of lists of indices or paths
+		:type deps: dict
+		:return: dict of lists of nodes
+		:rtype: dict
+		"""
+		tree = getattr(self, 'node_tree', None)
+		cache = {}
+		def get_node(p):
+			try:
+				return cache[p]
+			except KeyError:
+				if isinstance(p, int):
+					node = tree.get_node(p)
+				else:
+					node = self.root.make_node(p)
+				cache[p] = node
+				return node
+		for (k, v) in deps.items():
+			deps[k] = [get_node(p) for p in v]
+		return deps
+
+	def get_node_sigs(self):
+		"""
+		Collect the signatures of the nodes in the build directory, the folders that were
+		not visited since the tree was restored being skipped (:py:class:`waflib.Node.LazyChildren`)
+
+		:return: dict mapping the nodes to their signatures
+		:rtype: dict
+		"""
+		dct = {}
+		stack = [self.bldnode]
+		while stack:
+			node = stack.pop()
+			try:
+				dct[node] = node.sig
+			except AttributeError:
+				pass
+			try:
+				ch = node.children
+			except AttributeError:
+				pass
+			else:
+				if not isinstance(ch, waflib.Node.LazyChildren):
+					stack.extend(ch.values())
+		return dct
+
+	def get_deps_shard(self, tsk):
+		"""
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		:return: the shard of the dependencies of a task: the folder of its first input, or the folder of its task generator
+		:rtype: string
+		"""
+		try:
+			return tsk.inputs[0].parent.abspath()
+		except (AttributeError, IndexError):
+			try:
+				return tsk.generator.path.abspath()
+			except AttributeError:
+				return ''
+
+	def load_deps(self, path=''):
+		"""
+		The entries of node_deps and raw_deps are written to the journal in shards, one per source folder
+		(see :py:meth:`waflib.Build.BuildContext.get_deps_shard`, the other entries go to the shard ``''``).
+		A shard is only loaded when a task from its folder is created, so that the partial builds
+		(``--targets``, build from a sub-folder) do not process the dependencies of the whole project.
+
+		:param path: absolute path of the folder
+		:type path: string
+		"""
+		if path in self.deps_loaded:
+			return
+		self.deps_loaded.add(path)
+		for name in ('node_deps', 'raw_deps'):
+			try:
+				lst = self.deps_pending.pop((name, path))
+			except KeyError:
+				continue
+			dct = {}
+			for val in lst:
+				if val[0] == 'set':
+					dct = cPickle.loads(val[1])
+				else:
+					dct.update(val[1])
+					for k in val[2]:
+						dct.pop(k, None)
+			if name == 'node_deps':
+				self.decode_node_deps(dct)
+
+			cur = getattr(self, name)
+			for (k, v) in dct.items():
+				if not k in cur:
+					cur[k] = v
+				self.deps_shard.setdefault(k, path)
+			self.db_snapshot[(name, path)] = copy_table(dct)
+
+	def get_deps_tables(self):
+		"""
+		Split node_deps and raw_deps by shard, see :py:meth:`waflib.Build.BuildContext.load_deps`
+
+		:return: dict mapping the tuples (attribute name, shard) to dicts
+		:rtype: dict
+		"""
+		shards = self.deps_shard
+		for g in self.groups:
+			for tg in g:
+				if isinstance(tg, Task.Task):
+					lst = [tg]
+				else:
+					lst = getattr(tg, 'tasks', [])
+				for tsk in lst:
+					shards[tsk.uid()] = self.get_deps_shard(tsk)
+
+		tables = {}
+		for name in ('node_deps', 'raw_deps'):
+			for path in self.deps_loaded:
+				tables[(name, path)] = {}
+			for (k, v) in getattr(self, name).items():
+				try:
+					tables[(name, shards.get(k, ''))][k] = v
+				except KeyError:
+					tables[(name, shards.get(k, ''))] = {k: v}
+		return tables
+
+	def get_journal_tables(self, compact=False):
+		"""
+		:param compact: return the data for a compaction
+		:type compact: bool
+		:return: the data to store in the journal: the attributes listed in :py:const:`waflib.Build.SAVED_ATTRS`,
+			the node tree being flattened (compaction) or replaced by the signatures of the nodes in the build directory
+			(table ``node_sigs``), and the dependencies being split in shards
+		:rtype: dict
+		"""
+		tables = self.get_deps_tables()
+		for x in SAVED_ATTRS:
+			if x in ('node_deps', 'raw_deps'):
+				pass
+			elif x != 'root':
+				tables[x] = getattr(self, x)
+			elif compact:
+				(tables['root'], self.db_index) = self.dump_tree(self.bldnode)
+			else:
+				tables['node_sigs'] = self.get_node_sigs()
+				self.db_index = {}
+		return tables
+
+	def encode_journal_key(self, name, key):
+		"""
+		The nodes used as keys (table ``node_sigs``) are written as absolute paths in the journal
+		"""
+		if name == 'node_sigs':
+			return key.abspath()
+		return key
+
+	def encode_journal_value(self, name, val):
+		"""
+		Nodes are written as indices in the flattened tree or as absolute paths
+		in the journal (the node objects would drag the whole tree)
+		"""
+		if name == 'node_deps':
+			return self.encode_nodes(val, self.db_index)
+		return val
+
+	def restore_journal(self, path):
+		"""
+		Load the data from the journal written by :py:meth:`waflib.Build.BuildContext.store_journal`.
+		The journal is a sequence of pickled records: a header, then dicts mapping the table names
+		to either ``('update', changed_items, removed_keys)`` or ``('set', value)``.
+		An incomplete record at the end of the file (interrupted build) is ignored.
+
+		:param path: journal file path
+		:type path: string
+		:return: True if the journal could be read
+		:rtype: bool
+		"""
+		self.db_snapshot = {}
+		try:
+			f = open(path, 'rb')
+		except (IOError, OSError):
+			Logs.debug('build: Could not load the build journal %s (missing)' % path)
+			return False
+
+		tables = {}
+		removed = {}
+		try:
+			try:
+				header = cPickle.load(f)
+			except Exception as e:
+				Logs.debug('build: Could not read the build journal %s: %r' % (path, e))
+				return False
+			if header.get('hash') != Utils.hash_name:
+				# the signatures cannot be compared
+				Logs.debug('build: Discarding the build journal %s (hash function changed)' % path)
+				return True
+
+			self.db_offset = f.tell()
+			self.db_compacted = 0
+			while 1:
+				try:
+					rec = cPickle.load(f)
+				except EOFError:
+					break
+				except Exception as e:
+					Logs.debug('build: Incomplete record in the build journal %s: %r' % (path, e))
+					break
+				for (name, val) in rec.items():
+					if isinstance(name, tuple):
+						# dependency shard, loaded later
+						if val[0] == 'set':
+							self.deps_pending[name] = [val]
+						else:
+							self.deps_pending.setdefault(name, []).append(val)
+					elif val[0] == 'set':
+						tables[name] = val[1]
+					else:
+						dct = tables.setdefault(name, {})
+						dct.update(val[1])
+						rem = removed.setdefault(name, set())
+						rem.difference_update(val[1])
+						for k in val[2]:
+							dct.pop(k, None)
+							rem.add(k)
+				self.db_offset = f.tell()
+				if not self.db_compacted:
+					# size of the journal after the last compaction
+					self.db_compacted = self.db_offset
+		finally:
+			f.close()
+
+		try:
+			self.load_tree(tables.pop('root'))
+		except KeyError:
+			sigs = {}
+		else:
+			sigs = self.node_tree.sigs
+
+		# the nodes from the tree (compaction) are updated by the next records
+		for p in removed.get('node_sigs', []):
+			node = self.root.search_node(p)
+			if node:
+				try:
+					del node.sig
+				except AttributeError:
+					pass
+				sigs.pop(node, None)
+		for (p, sig) in tables.pop('node_sigs', {}).items():
+			node = self.root.make_node(p)
+			node.sig = sigs[node] = sig
+		self.db_snapshot['node_sigs'] = sigs
+		self.load_deps()
+
+		for (name, val) in tables.items():
+			if name in SAVED_ATTRS:
+				setattr(self, name, val)
+			# copies of the data written, to detect the changes in store_journal
+			if isinstance(val, dict):
+				val = copy_table(val)
+			self.db_snapshot[name] = val
+		return True
+
+	def store_journal(self, compact=False):
+		"""
+		Append the entries added, modified or removed since the previous call (or since :py:meth:`waflib.Build.BuildContext.restore_journal`)
+		to the journal, so that only the data of the tasks executed is written. The journal is rewritten
+		(compacted) when it becomes :py:const:`waflib.Build.COMPACT_RATIO` times larger than after the previous compaction.
+
+		:param compact: force the compaction
+		:type compact: bool
+		"""
+		path = os.path.join(self.variant_dir, Context.DBFILE + JOURNAL_SUFFIX)
+		snapshot = getattr(self, 'db_snapshot', {})
+		offset = getattr(self, 'db_offset', 0)
+
+		try:
+			size = os.stat(path).st_size
+		except OSError:
+			size = -1
+		if size < offset or not offset:
+			# missing or modified by another process
+			compact = True
+		elif offset > COMPACT_RATIO * max(getattr(self, 'db_compacted', 0), 65536):
+			compact = True
+
+		if compact:
+			for (name, path) in list(self.deps_pending.keys()):
+				self.load_deps(path)
+		tables = self.get_journal_tables(compact)
+		rec = {}
+		try:
+			# the signatures of the nodes created from the tree since the last call
+			prev = snapshot['node_sigs']
+			for (k, v) in self.node_tree.sigs.items():
+				prev.setdefault(k, v)
+		except (KeyError, AttributeError):
+			pass
+
+		for (name, cur) in tables.items():
+			prev = snapshot.get(name)
+			if name == 'root':
+				rec[name] = ('set', cur)
+				continue
+			if compact and isinstance(name, tuple):
+				# the shards are unpickled separately when loaded
+				if cur:
+					dct = dict((k, self.encode_journal_value(name[0], v)) for (k, v) in cur.items())
+					rec[name] = ('set', cPickle.dumps(dct, -1))
+				snapshot[name] = copy_table(cur)
+				continue
+			if not isinstance(cur, dict):
+				if compact or prev != cur:
+					rec[name] = ('set', cur)
+				snapshot[name] = cur
+				continue
+
+			if compact or prev is None:
+				upd = cur
+				rem = []
+			else:
+				upd = {}
+				for (k, v) in cur.items():
+					try:
+						old = prev[k]
+					except KeyError:
+						upd[k] = v
+					else:
+						if old is not v and old != v:
+							upd[k] = v
+				rem = [k for k in prev if not k in cur]
+			if upd or rem or compact:
+				attr = isinstance(name, tuple) and name[0] or name
+				upd = dict((self.encode_journal_key(attr, k), self.encode_journal_value(attr, v)) for (k, v) in upd.items())
+				rec[name] = ('update', upd, [self.encode_journal_key(attr, k) for k in rem])
+			snapshot[name] = copy_table(cur)
+		if compact:
+			# the signatures are in the tree
+			snapshot['node_sigs'] = self.get_node_sigs()
+		self.db_snapshot = snapshot
+		self.db_index = {}
+
+		if compact:
+			data = cPickle.dumps({'hash': Utils.hash_name}, -1) + cPickle.dumps(rec, -1)
+			self.replace_db(path, data)
+			self.db_offset = self.db_compacted = len(data)
+		elif rec:
+			f = open(path, 'r+b')
+			try:
+				# drop the incomplete records, if any
+				f.seek(offset)
+				f.truncate()
+				cPickle.dump(rec, f, -1)
+				self.db_offset = f.tell()
+			finally:
+				f.close()
+
+	def hash_file(self, path):
+		"""
+		Return the hash of a file (:py:func:`waflib.Utils.h_file`). The value is stored in :py:attr:`waflib.Build.BuildContext.file_hashes`
+		along with the inode, modification time, size and change time of the file, and the file is only hashed again when
+		one of these values changes. This turns the no-op builds into a sweep of ``stat`` calls.
+
+		:param path: absolute file path
+		:type path: string
+		:return: hash value
+		:rtype: string
+		"""
+		st = os.stat(path)
+		if stat.S_ISDIR(st.st_mode):
+			raise IOError('not a file')
+		self.hashed_files.add(path)
+		try:
+			mtime = st.st_mtime_ns
+		except AttributeError:
+			mtime = int(st.st_mtime * 1000000000)
+		key = (st.st_ino, mtime, st.st_size, st.st_ctime)
+
+		try:
+			(prev, ret) = self.file_hashes[path]
+		except KeyError:
+			pass
+		else:
+			if prev == key:
+				return ret
+
+		ret = Utils.h_file(path)
+		if st.st_mtime < time.time() - HASH_DELAY:
+			self.file_hashes[path] = (key, ret)
+			self.file_hashes_dirty = True
+		return ret
+
+	def get_manifest_path(self):
+		"""
+		:return: path of the build manifest
+		:rtype: string
+		"""
+		return os.path.join(self.variant_dir, Context.DBFILE + MANIFEST_SUFFIX)
+
+	def get_manifest_key(self):
+		"""
+		:return: hash of the waf version, of the command and of the command-line options
+		:rtype: string
+		"""
+		opts = sorted(vars(Options.options).items())
+		return self.h_manifest([Context.HEXVERSION, Context.ABI, self.cmd, self.launch_dir, opts])
+
+	def h_manifest(self, lst):
+		"""
+		Hash function for the build manifest and the task graph: md5 is always used, as the manifest is read
+		before :py:meth:`waflib.Build.BuildContext.restore` selects the hash function of the project (:py:func:`waflib.Utils.set_hash`)
+
+		:param lst: list to hash
+		:type lst: list
+		:rtype: string
+		"""
+		m = Utils.md5_orig()
+		m.update(str(lst).encode())
+		return m.digest()
+
+	def hash_manifest_files(self, lst):
+		"""
+		:param lst: absolute paths
+		:type lst: list of string
+		:return: hash of the status (inode, modification time, size, change time) of the files
+		:rtype: string
+		"""
+		ret = []
+		for x in lst:
+			try:
+				st = os.stat(x)
+			except OSError:
+				ret.append(None)
+				continue
+			try:
+				mtime = st.st_mtime_ns
+			except AttributeError:
+				mtime = int(st.st_mtime * 1000000000)
+			ret.append((st.st_ino, mtime, st.st_size, st.st_ctime))
+		return self.h_manifest(ret)
+
+	def check_manifest(self):
+		"""
+		When the build manifest is enabled (``waf build --manifest``), compare the scripts, the configuration files,
+		the command-line options and the files used by the tasks with the ones recorded by
+		:py:meth:`waflib.Build.BuildContext.store_manifest`. If nothing changed, the build is known to have nothing
+		to do, and the build functions are not even executed (the functions added by
+		:py:meth:`waflib.Build.BuildContext.add_post_fun` are not called either). The environment variables
+		and the Python modules imported by the scripts are not tracked.
+
+		:return: True if the build can be skipped
+		:rtype: bool
+		"""
+		if not self.manifest or self.is_install or getattr(self, 'files', None):
+			return False
+		path = self.get_manifest_path()
+		try:
+			data = cPickle.loads(Utils.readf(path, 'rb'))
+		except Exception:
+			Logs.debug('build: Could not read the build manifest %s' % path)
+			return False
+		if data['key'] != self.get_manifest_key():
+			Logs.debug('build: The command-line options changed')
+			return False
+		return data['hash'] == self.hash_manifest_files(data['files'])
+
+	def store_manifest(self, tasks):
+		"""
+		Record the files read by :py:meth:`waflib.Build.BuildContext.check_manifest` after a build that had nothing to do:
+		the scripts, the configuration files, and the inputs, outputs and dependencies of the tasks processed
+
+		:param tasks: tasks processed
+		:type tasks: list of :py:class:`waflib.Task.TaskBase`
+		"""
+		if self.is_install or getattr(self, 'files', None):
+			return
+
+		files = set(self.get_graph_files())
+		nodes = set()
+		for tsk in tasks:
+			nodes.update(tsk.inputs)
+			nodes.update(tsk.outputs)
+			nodes.update(getattr(tsk, 'dep_nodes', []))
+			nodes.update(self.node_deps.get(tsk.uid(), []))
+		for lst in self.deps_man.values():
+			nodes.update(x for x in lst if isinstance(x, waflib.Node.Node))
+		files.update(x.abspath() for x in nodes)
+
+		lst = sorted(files)
+		data = {'key': self.get_manifest_key(), 'files': lst, 'hash': self.hash_manifest_files(lst)}
+		self.replace_db(self.get_manifest_path(), cPickle.dumps(data, -1))
+
+	def get_graph_files(self):
+		"""
+		:return: the files that may change the task generators: the scripts, the configuration files, and the folders listed
+		:rtype: list of string
+		"""
+		if self.graph_files is not None:
+			return self.graph_files
+		files = set()
+		for x in getattr(self, 'recurse_cache', {}):
+			if isinstance(x, tuple):
+				x = x[0]
+			files.add(x.abspath())
+		for x in Utils.listdir(self.cache_dir):
+			files.add(os.path.join(self.cache_dir, x))
+		files.update(x.abspath() for x in self.listed_dirs)
+		return sorted(files)
+
+	def store_graph(self, groups):
+		"""
+		Serialize the tasks created by the task generators (``waf build --task-graph``) before they are executed,
+		along with the manual dependencies. The nodes are written as paths, the task classes by name, and
+		the graph is not written if any object cannot be serialized (rule functions from the scripts for example).
+
+		:param groups: lists of tasks, one per build group
+		:type groups: list of list of :py:class:`waflib.Task.TaskBase`
+		"""
+		path = os.path.join(self.variant_dir, Context.DBFILE + GRAPH_SUFFIX)
+		def persistent_id(obj):
+			if isinstance(obj, waflib.Node.Node):
+				return ('node', obj.abspath())
+			elif obj is self:
+				return ('bld', None)
+			elif isinstance(obj, type) and Task.classes.get(obj.__name__) is obj:
+				return ('cls', obj.__name__)
+			return None
+
+		files = self.get_graph_files()
+		f = io.BytesIO()
+		try:
+			p = cPickle.Pickler(f, -1)
+			p.dump((self.get_manifest_key(), files, self.hash_manifest_files(files)))
+			p.persistent_id = persistent_id
+			p.dump((groups, self.deps_man))
+		except Exception as e:
+			Logs.debug('build: Could not store the task graph: %r' % e)
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+		else:
+			self.replace_db(path, f.getvalue())
+
+	def load_graph(self):
+		"""
+		Restore the tasks written by :py:meth:`waflib.Build.BuildContext.store_graph` if the scripts, the configuration
+		files, the folders listed and the command-line options did not change. The scripts and the build functions
+		are then not executed (the functions added by :py:meth:`waflib.Build.BuildContext.add_pre_fun` and
+		:py:meth:`waflib.Build.BuildContext.add_post_fun` are not called either), and the tasks are given directly
+		to :py:class:`waflib.Runner.Parallel`.
+
+		:return: True if the tasks were restored
+		:rtype: bool
+		"""
+		if not self.task_graph or self.is_install or getattr(self, 'files', None):
+			return False
+		path = os.path.join(self.variant_dir, Context.DBFILE + GRAPH_SUFFIX)
+		try:
+			f = open(path, 'rb')
+		except (IOError, OSError):
+			return False
+
+		cache = {}
+		def persistent_load(pid):
+			if pid[0] == 'node':
+				try:
+					return cache[pid[1]]
+				except KeyError:
+					node = cache[pid[1]] = self.root.make_node(pid[1])
+					return node
+			elif pid[0] == 'bld':
+				return self
+			return Task.classes[pid[1]]
+
+		try:
+			try:
+				p = cPickle.Unpickler(f)
+				(key, files, h) = p.load()
+				if key != self.get_manifest_key() or h != self.hash_manifest_files(files):
+					Logs.debug('build: The task graph is obsolete')
+					return False
+				p.persistent_load = persistent_load
+				(groups, deps_man) = p.load()
+			except Exception as e:
+				Logs.debug('build: Could not load the task graph %s: %r' % (path, e))
+				return False
+		finally:
+			f.close()
+
+		for tasks in groups:
+			for tsk in tasks:
+				self.load_deps(self.get_deps_shard(tsk))
+				# same as waflib.Node.Node.find_or_declare
+				for node in tsk.outputs:
+					if not os.path.isfile(node.abspath()):
+						node.sig = None
+						node.parent.mkdir()
+		self.groups = [list(x) for x in groups]
+		self.deps_man = deps_man
+		self.graph_groups = groups
+		self.graph_files = files
+		return True
+
+	def is_full_build(self):
+		"""
+		:return: True if all the task generators are posted: no ``--targets``, and the build is not started from a sub-folder
+		:rtype: bool
+		"""
+		if self.targets == '*':
+			return True
+		elif self.targets:
+			return False
+		ln = self.launch_node()
+		return ln is self.srcnode or ln.is_child_of(self.bldnode) or not ln.is_child_of(self.srcnode)
+
+	def prune(self, uids):
+		"""
+		Mark and sweep: remove the entries of :py:attr:`waflib.Build.BuildContext.task_sigs`, node_deps, raw_deps,
+		task_durations and file_hashes that were not used during a full build, for example after task generators
+		were removed or renamed. Called by :py:meth:`waflib.Build.BuildContext.compile` when :py:const:`waflib.Build.PRUNE` is set.
+
+		:param uids: identifiers of the tasks processed (:py:meth:`waflib.Task.Task.uid`)
+		:type uids: set
+		:return: amount of entries removed
+		:rtype: int
+		"""
+		# entries from the folders that were not visited
+		for (name, path) in list(self.deps_pending.keys()):
+			self.load_deps(path)
+
+		def used_sig(k, v):
+			if k in uids:
+				return True
+			elif isinstance(k, tuple):
+				# signature of the implicit dependencies
+				return k[0] in uids
+			try:
+				# outputs of the update_outputs tasks
+				return v in uids
+			except TypeError:
+				return False
+		def used_deps(k, v):
+			# keys other than the task uids are set by the scanners (qt4)
+			return k in uids or isinstance(k, tuple)
+		def used_task(k, v):
+			if isinstance(k, tuple):
+				# estimated durations of the files compiled in unity batches
+				return k[0] in uids
+			return k in uids
+		def used_file(k, v):
+			return k in self.hashed_files
+
+		stats = []
+		for (name, used) in (('task_sigs', used_sig), ('node_deps', used_deps), ('raw_deps', used_deps),
+				('task_durations', used_task), ('file_hashes', used_file)):
+			dct = getattr(self, name)
+			removed = dict((k, v) for (k, v) in dct.items() if not used(k, v))
+			if removed:
+				for k in removed:
+					del dct[k]
+				if name == 'node_deps':
+					removed = dict((k, self.encode_nodes(v, {})) for (k, v) in removed.items())
+				stats.append((name, len(removed), len(cPickle.dumps(removed, -1))))
+
+		if stats:
+			msg = ', '.join('%s: %d entries (%d bytes)' % x for x in stats)
+			if Logs.verbose:
+				Logs.info('Removed from the build data %s' % msg)
+			else:
+				Logs.debug('build: removed from the build data %s' % msg)
+		return sum(x[1] for x in stats)
+
 	def compile(self):
 		"""
 		Run the build by creating an instance of :py:class:`waflib.Runner.Parallel`
@@ -362,8 +1269,19 @@ class BuildContext(Context.Context):
 			self.store()
 			raise
 		else:
-			if self.producer.dirty:
+			if PRUNE and not self.producer.error and self.is_full_build():
+				if self.prune(self.producer.uids):
+					self.producer.dirty = True
+			if self.producer.dirty or self.file_hashes_dirty:
 				self.store()
+			if self.manifest and not self.producer.error:
+				if self.producer.dirty:
+					try:
+						os.remove(self.get_manifest_path())
+					except OSError:
+						pass
+				else:
+					self.store_manifest(self.producer.done)
 
 		if self.producer.error:
 			raise Errors.BuildError(self.producer.error)
@@ -773,13 +1691,38 @@ class BuildContext(Context.Context):
 		if self.targets and self.targets != '*':
 			(self._min_grp, self._exact_tg) = self.get_targets()
 
+		if self.post_mode != POST_AT_ONCE:
+			# the task generators of the next groups may use the files created by the previous groups
+			self.pipeline = False
+
 		global lazy_post
-		if self.post_mode != POST_LAZY:
+		if self.post_mode != POST_LAZY and self.graph_groups is None:
 			while self.cur < len(self.groups):
 				self.post_group()
 				self.cur += 1
 			self.cur = 0
 
+			if self.task_graph and self.post_mode == POST_AT_ONCE and not self.is_install:
+				# store the tasks before they are executed, see load_graph
+				groups = []
+				while self.cur < len(self.groups):
+					tasks = self.get_tasks_group(self.cur)
+					Task.set_file_constraints(tasks)
+					Task.set_precedence_constraints(tasks)
+					if tasks:
+						groups.append(tasks)
+					self.cur += 1
+				self.store_graph(groups)
+				self.graph_groups = groups
+
+		if self.graph_groups is not None:
+			# as below, self.cur is the index of the next group while the tasks of a group are processed
+			# (Runner.Parallel.add_next_group, and the caches bound to the group in Task.are_implicit_nodes_ready)
+			for (self.cur, tasks) in enumerate(self.graph_groups, 1):
+				self.cur_tasks = tasks
+				yield tasks
+			self.cur = len(self.groups)
+
 		while self.cur < len(self.groups):
 			# first post the task generators for the group
 			if self.post_mode != POST_AT_ONCE:
@@ -1215,8 +2158,10 @@ class CleanContext(BuildContext):
 				n.delete()
 		self.root.children = {}
 
-		for v in 'node_deps task_sigs raw_deps'.split():
+		for v in 'node_deps task_sigs raw_deps deps_pending deps_shard'.split():
 			setattr(self, v, {})
+		# rewrite the journal
+		self.db_offset = 0
 
 class ListContext(BuildContext):
 	'''lists the targets to execute'''
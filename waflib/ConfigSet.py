@@ -131,6 +131,16 @@ class ConfigSet(object):
 		else:
 			del self[name]
 
+	def __reduce__(self):
+		"Pickle the table and the parent (the attribute access would return [] for __getstate__ or __getnewargs__)"
+		return (self.__class__, (), (self.table, getattr(self, 'parent', None)))
+
+	def __setstate__(self, data):
+		"Deserialize from data"
+		self.table = data[0]
+		if data[1] is not None:
+			self.parent = data[1]
+
 	def derive(self):
 		"""
 		Returns a new ConfigSet deriving from self. The copy returned
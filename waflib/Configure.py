@@ -215,6 +215,11 @@ class ConfigurationContext(Context.Context):
 			if self.srcnode.is_child_of(self.path):
 				Logs.warn('Are you certain that you do not want to set top="." ?')
 
+		try:
+			Utils.set_hash(Options.options.hash)
+		except Errors.WafError as e:
+			self.fatal(str(e))
+
 		super(ConfigurationContext, self).execute()
 
 		self.store()
@@ -266,7 +271,7 @@ class ConfigurationContext(Context.Context):
 	def store(self):
 		"""Save the config results into the cache file"""
 		n = self.cachedir.make_node('build.config.py')
-		n.write('version = 0x%x\ntools = %r\n' % (Context.HEXVERSION, self.tools))
+		n.write('version = 0x%x\ntools = %r\nhash = %r\n' % (Context.HEXVERSION, self.tools, Utils.hash_name))
 
 		if not self.all_envs:
 			self.fatal('nothing to store in the configuration context!')
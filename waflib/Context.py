@@ -20,7 +20,7 @@ WAFVERSION="1.7.16"
 WAFREVISION="73c1705078f8c9c51a33e20f221a309d5a94b5e1"
 """Constant updated on new releases"""
 
-ABI = 98
+ABI = 102
 """Version of the build data cache file format (used in :py:const:`waflib.Context.DBFILE`)"""
 
 DBFILE = '.wafpickle-%s-%d-%d' % (sys.platform, sys.hexversion, ABI)
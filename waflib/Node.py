@@ -21,6 +21,7 @@ Node: filesystem structure, contains lists of nodes
 """
 
 import os, re, sys, shutil
+from array import array
 from waflib import Utils, Errors
 
 exclude_regs = '''
@@ -215,6 +216,11 @@ class Node(object):
 		"""List the folder contents"""
 		lst = Utils.listdir(self.abspath())
 		lst.sort()
+		try:
+			# the folder contents may change the task generators, see waflib.Build.BuildContext.store_graph
+			self.ctx.listed_dirs.add(self)
+		except AttributeError:
+			pass
 		return lst
 
 	def mkdir(self):
@@ -794,7 +800,11 @@ class Node(object):
 			pass
 
 		if not self.is_bld() or self.ctx.bldnode is self.ctx.srcnode:
-			self.sig = Utils.h_file(self.abspath())
+			try:
+				h_file = self.ctx.hash_file
+			except AttributeError:
+				h_file = Utils.h_file
+			self.sig = h_file(self.abspath())
 		self.cache_sig = ret = self.sig
 		return ret
 
@@ -810,3 +820,255 @@ class Nod3(Node):
 	pass # do not remove
 
 
+
+SIG_SIZE = 16
+"""Size of the node signatures stored in the buffer of a compact tree, the other values are stored in a dict"""
+
+HAS_SIG = 1
+EXTRA_SIG = 2
+HAS_CHILDREN = 4
+
+def to_bytes(a):
+	"Return the contents of an array as bytes"
+	try:
+		return a.tobytes()
+	except AttributeError:
+		return a.tostring()
+
+def from_bytes(code, data):
+	"Create an array from bytes returned by :py:func:`waflib.Node.to_bytes`"
+	a = array(code)
+	try:
+		a.frombytes(data)
+	except AttributeError:
+		a.fromstring(data)
+	return a
+
+class LazyChildren(dict):
+	"""
+	Children of a node restored from a :py:class:`waflib.Node.CompactTree`. The child nodes are only created
+	when the dict is accessed for the first time, the attribute ``children`` of the node is then replaced by a regular dict.
+	"""
+	__slots__ = ('node', 'tree', 'idx', 'base', 'loaded')
+	def __init__(self, node, tree, idx, base):
+		dict.__init__(self)
+		self.node = node
+		self.tree = tree
+		self.idx = idx
+		self.base = base
+
+	def load(self):
+		"Create the child nodes, return the regular dict"
+		try:
+			return self.loaded
+		except AttributeError:
+			pass
+		self.loaded = self.node.children = dct = self.base
+		self.tree.load_children(self.node, self.idx, dct)
+		return dct
+
+	def __reduce__(self):
+		return (dict, (self.load(),))
+
+def lazy_method(name):
+	def f(self, *k, **kw):
+		return getattr(self.load(), name)(*k, **kw)
+	f.__name__ = name
+	return f
+
+for x in ('__contains__ __getitem__ __setitem__ __delitem__ __iter__ __len__ __eq__ __ne__ __repr__ '
+		'get keys values items pop popitem setdefault update clear copy has_key iterkeys itervalues iteritems').split():
+	if hasattr(dict, x):
+		setattr(LazyChildren, x, lazy_method(x))
+
+class CompactTree(object):
+	"""
+	Node tree flattened into arrays in depth-first order: for each node the offset to the parent
+	index, an interned name id, the size of the subtree and flags, the signatures being concatenated
+	in a single buffer. It is created by :py:func:`waflib.Node.load_tree`, and the node objects are
+	only created for the folders that are actually visited (:py:class:`waflib.Node.LazyChildren`).
+	"""
+	def __init__(self, data):
+		(self.names, parents, ids, sizes, flags, self.blob, self.extra) = data
+		self.parents = from_bytes('i', parents)
+		self.ids = from_bytes('i', ids)
+		self.sizes = from_bytes('i', sizes)
+		self.flags = from_bytes('b', flags)
+
+		self.nodes = {}
+		"""Nodes created, by index"""
+
+		self.sigs = {}
+		"""Signatures restored, by node"""
+
+	def load_node(self, node, idx):
+		"Set the signature and the (lazy) children of a node"
+		self.nodes[idx] = node
+		f = self.flags[idx]
+		if f & HAS_SIG:
+			node.sig = self.sigs[node] = self.blob[SIG_SIZE * idx:SIG_SIZE * (idx + 1)]
+		elif f & EXTRA_SIG:
+			node.sig = self.sigs[node] = self.extra[idx]
+		if f & HAS_CHILDREN:
+			try:
+				base = node.children
+			except AttributeError:
+				base = {}
+			if self.sizes[idx] > 1 and not isinstance(base, LazyChildren):
+				node.children = LazyChildren(node, self, idx, base)
+			else:
+				node.children = base
+
+	def load_children(self, node, idx, dct):
+		"Create the child nodes of a folder"
+		cls = node.__class__
+		names = self.names
+		ids = self.ids
+		sizes = self.sizes
+		j = idx + 1
+		end = idx + sizes[idx]
+		while j < end:
+			name = names[ids[j]]
+			try:
+				child = dct[name]
+			except KeyError:
+				child = cls(name, node)
+			self.load_node(child, j)
+			j += sizes[j]
+
+	def get_node(self, idx):
+		"""
+		Return the node at an index, creating the parent folders as needed
+
+		:param idx: index in the arrays
+		:type idx: int
+		:rtype: :py:class:`waflib.Node.Node`
+		"""
+		try:
+			return self.nodes[idx]
+		except KeyError:
+			pass
+		parent = self.get_node(idx - self.parents[idx])
+		try:
+			len(parent.children)
+		except AttributeError:
+			parent.children = {}
+		try:
+			return self.nodes[idx]
+		except KeyError:
+			# removed from the tree in the meantime
+			return parent.make_node([self.names[self.ids[idx]]])
+
+def dump_tree(node, sig_root=None, base=None):
+	"""
+	Flatten the tree under a node for :py:func:`waflib.Node.load_tree`. The folders that were
+	not visited since the tree was restored are copied from the arrays directly.
+
+	:param node: top-level node, usually the root
+	:type node: :py:class:`waflib.Node.Node`
+	:param sig_root: store the signatures of the nodes under this folder only (all if None)
+	:type sig_root: :py:class:`waflib.Node.Node`
+	:param base: compact tree to take the name ids from
+	:type base: :py:class:`waflib.Node.CompactTree`
+	:return: a tuple containing the serializable data, and a dict mapping the nodes created to their indices
+	:rtype: tuple
+	"""
+	names = base and list(base.names) or []
+	name_ids = dict((x, i) for (i, x) in enumerate(names))
+	remaps = {}
+	parents = array('i')
+	ids = array('i')
+	sizes = array('i')
+	flags = array('b')
+	blob = []
+	extra = {}
+	index = {}
+	nil = b'\0' * SIG_SIZE
+
+	stack = [(node, 0, sig_root is None)]
+	while stack:
+		(cur, up, keep) = stack.pop()
+		if cur is None:
+			# all children were added
+			sizes[up] = len(sizes) - up
+			continue
+
+		idx = len(ids)
+		index[cur] = idx
+		parents.append(idx - up)
+		try:
+			ids.append(name_ids[cur.name])
+		except KeyError:
+			name_ids[cur.name] = len(names)
+			ids.append(len(names))
+			names.append(cur.name)
+		sizes.append(1)
+
+		f = 0
+		keep = keep or cur is sig_root
+		sig = keep and getattr(cur, 'sig', None) or None
+		if isinstance(sig, bytes) and len(sig) == SIG_SIZE:
+			f |= HAS_SIG
+			blob.append(sig)
+		else:
+			blob.append(nil)
+			if sig is not None:
+				f |= EXTRA_SIG
+				extra[idx] = sig
+
+		try:
+			ch = cur.children
+		except AttributeError:
+			flags.append(f)
+			continue
+		flags.append(f | HAS_CHILDREN)
+
+		if isinstance(ch, LazyChildren) and not hasattr(ch, 'loaded') and not ch.base:
+			# copy the folders that were never visited
+			tree = ch.tree
+			a = ch.idx + 1
+			b = ch.idx + tree.sizes[ch.idx]
+			parents.extend(tree.parents[a:b])
+			if tree is base:
+				ids.extend(tree.ids[a:b])
+			else:
+				try:
+					m = remaps[tree]
+				except KeyError:
+					m = remaps[tree] = []
+					for x in tree.names:
+						try:
+							m.append(name_ids[x])
+						except KeyError:
+							name_ids[x] = len(names)
+							m.append(len(names))
+							names.append(x)
+				ids.extend(array('i', [m[i] for i in tree.ids[a:b]]))
+			sizes.extend(tree.sizes[a:b])
+			flags.extend(tree.flags[a:b])
+			blob.append(tree.blob[SIG_SIZE * a:SIG_SIZE * b])
+			for (k, v) in tree.extra.items():
+				if a <= k < b:
+					extra[k - a + idx + 1] = v
+			sizes[idx] = b - a + 1
+		else:
+			stack.append((None, idx, keep))
+			stack.extend([(x, idx, keep) for x in ch.values()])
+
+	data = (names, to_bytes(parents), to_bytes(ids), to_bytes(sizes), to_bytes(flags), b''.join(blob), extra)
+	return (data, index)
+
+def load_tree(node, data):
+	"""
+	Restore a tree flattened by :py:func:`waflib.Node.dump_tree` under a node (usually the root),
+	the child nodes being created lazily
+
+	:param node: top-level node
+	:type node: :py:class:`waflib.Node.Node`
+	:param data: serialized data
+	:type data: tuple
+	:rtype: :py:class:`waflib.Node.CompactTree`
+	"""
+	tree = CompactTree(data)
+	tree.load_node(node, 0)
+	return tree
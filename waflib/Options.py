@@ -53,10 +53,13 @@ class opt_parser(optparse.OptionParser):
 		self.ctx = ctx
 
 		jobs = ctx.jobs()
-		p('-j', '--jobs',     dest='jobs',    default=jobs, type='int', help='amount of parallel jobs (%r)' % jobs)
+		p('-j', '--jobs',     dest='jobs',    default=jobs, type='string', action='callback', callback=self.parse_jobs, help='amount of parallel jobs (%r), or auto[:min[:max]] to follow the system load' % jobs)
 		p('-k', '--keep',     dest='keep',    default=0,     action='count', help='keep running happily even if errors are found')
 		p('-v', '--verbose',  dest='verbose', default=0,     action='count', help='verbosity level -v -vv or -vvv [default: 0]')
 		p('--nocache',        dest='nocache', default=False, action='store_true', help='ignore the WAFCACHE (if set)')
+		p('--cache-codec',    dest='cache_codec', default=os.environ.get('WAFCACHE_CODEC', ''), action='store', help='compress the files stored in the WAFCACHE: zlib or lzma, with an optional level such as lzma:3')
+		p('--cache-links',    dest='cache_links', default=bool(os.environ.get('WAFCACHE_LINKS', '')), action='store_true', help='share the files of the WAFCACHE with the build directories by hard links (the build files must not be modified in place)')
+		p('--cache-async',    dest='cache_async', default='', action='store', type='choice', choices=['', 'flush', 'abandon'], help='store the files in the cache in the background, and at the end of the build wait for the pending uploads (flush) or drop them (abandon)')
 		p('--zones',          dest='zones',   default='',    action='store', help='debugging zones (task_gen, deps, tasks, etc)')
 
 		gr = optparse.OptionGroup(self, 'configure options')
@@ -75,6 +78,7 @@ class opt_parser(optparse.OptionParser):
 				default_prefix = '/usr/local/'
 		gr.add_option('--prefix', dest='prefix', default=default_prefix, help='installation prefix [default: %r]' % default_prefix)
 		gr.add_option('--download', dest='download', default=False, action='store_true', help='try to download the tools if missing')
+		gr.add_option('--hash', dest='hash', default='md5', action='store', help='hash function for the signatures: md5, blake2b or xxhash [default: %default]')
 
 
 		gr = optparse.OptionGroup(self, 'build and install options')
@@ -82,6 +86,11 @@ class opt_parser(optparse.OptionParser):
 
 		gr.add_option('-p', '--progress', dest='progress_bar', default=0, action='count', help= '-p: progress bar; -pp: ide output')
 		gr.add_option('--targets',        dest='targets', default='', action='store', help='task generators, e.g. "target1,target2"')
+		gr.add_option('--critical-path',  dest='critical_path', default=False, action='store_true', help='execute the longest task chains first (uses the task durations of previous builds)')
+		gr.add_option('--pipeline',       dest='pipeline', default=False, action='store_true', help='start the tasks of the next build groups before the current group is complete')
+		gr.add_option('--manifest',       dest='manifest', default=False, action='store_true', help='do not read the scripts if no file changed since the last build having nothing to do')
+		gr.add_option('--unity',          dest='unity', default=0, type='int', action='store', help='compile the c/c++ files by batches of about this many files, 0 to disable [default: %default]')
+		gr.add_option('--task-graph',     dest='task_graph', default=False, action='store_true', help='reuse the tasks of the previous build if the scripts and the configuration did not change')
 
 		gr = optparse.OptionGroup(self, 'step options')
 		self.add_option_group(gr)
@@ -95,6 +104,28 @@ class opt_parser(optparse.OptionParser):
 
 		gr.add_option('--distcheck-args', help='arguments to pass to distcheck', default=None, action='store')
 
+		self.set_defaults(jobs_auto=None)
+
+	def parse_jobs(self, option, opt_str, value, parser):
+		"""
+		Callback for the option ``-j``/``--jobs``, which accepts an amount of jobs or ``auto[:min[:max]]``.
+		In the auto mode, ``options.jobs`` is set to the maximum amount of jobs (default: amount of cpu cores),
+		and ``options.jobs_auto`` to the tuple (min, max) used by :py:meth:`waflib.Runner.Parallel.adjust_jobs`.
+		"""
+		try:
+			if value.startswith('auto'):
+				lst = value.split(':')
+				floor = len(lst) > 1 and int(lst[1]) or 1
+				ceiling = len(lst) > 2 and int(lst[2]) or self.ctx.jobs()
+				ceiling = max(floor, ceiling)
+				parser.values.jobs = ceiling
+				parser.values.jobs_auto = (floor, ceiling)
+			else:
+				parser.values.jobs = int(value)
+				parser.values.jobs_auto = None
+		except ValueError:
+			raise optparse.OptionValueError('option %s: invalid value: %r' % (opt_str, value))
+
 	def get_usage(self):
 		"""
 		Return the message to print on ``waf --help``
@@ -242,6 +273,19 @@ class OptionsContext(Context.Context):
 		if options.destdir:
 			options.destdir = os.path.abspath(os.path.expanduser(options.destdir))
 
+		if options.cache_codec:
+			from waflib import Task
+			lst = options.cache_codec.split(':')
+			level = None
+			try:
+				if len(lst) > 1:
+					level = int(lst[1])
+			except ValueError:
+				self.parser.error('invalid level for --cache-codec: %r' % options.cache_codec)
+			if not lst[0] in Task.CACHE_CODECS:
+				self.parser.error('unsupported codec for --cache-codec: %r (use one of %r)' % (lst[0], sorted(Task.CACHE_CODECS.keys())))
+			options.cache_codec = (lst[0], level)
+
 		if options.verbose >= 1:
 			self.load('errcheck')
 
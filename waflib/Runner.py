@@ -7,11 +7,15 @@ Runner.py: Task scheduling and execution
 
 """
 
-import random, atexit
+import os, time, random, atexit, heapq
 try:
-	from queue import Queue
+	from queue import Queue, Full
 except ImportError:
-	from Queue import Queue
+	from Queue import Queue, Full
+try:
+	import multiprocessing
+except ImportError:
+	multiprocessing = None
 from waflib import Utils, Task, Errors, Logs
 
 GAP = 10
@@ -19,6 +23,47 @@ GAP = 10
 Wait for free tasks if there are at least ``GAP * njobs`` in queue
 """
 
+AUTO_INTERVAL = 1.0
+"""
+Interval in seconds between two samples of the system load when the amount of jobs is adaptive (``waf -j auto``)
+"""
+
+AUTO_LOG = 'jobs_auto.log'
+"""
+File in the build directory recording the decisions made when the amount of jobs is adaptive
+"""
+
+UPLOAD_QUEUE = 64
+"""
+Maximum amount of tasks waiting for their outputs to be stored in the cache in the background (``waf --cache-async``),
+see :py:class:`waflib.Runner.CacheUploader`
+"""
+
+def get_system_load():
+	"""
+	Read the system load from ``/proc/loadavg`` and ``/proc/meminfo``, used by :py:meth:`waflib.Runner.Parallel.adjust_jobs`
+
+	:return: a tuple (1-minute load average, available memory in kB, total memory in kB), the values are None if unknown
+	:rtype: tuple
+	"""
+	load = avail = total = None
+	try:
+		load = float(Utils.readf('/proc/loadavg').split()[0])
+	except (IOError, OSError, ValueError, IndexError):
+		try:
+			load = os.getloadavg()[0]
+		except (AttributeError, OSError):
+			pass
+	try:
+		for line in Utils.readf('/proc/meminfo').splitlines():
+			if line.startswith('MemTotal:'):
+				total = int(line.split()[1])
+			elif line.startswith('MemAvailable:'):
+				avail = int(line.split()[1])
+	except (IOError, OSError, ValueError, IndexError):
+		pass
+	return (load, avail, total)
+
 class TaskConsumer(Utils.threading.Thread):
 	"""
 	Task consumers belong to a pool of workers
@@ -55,6 +100,151 @@ class TaskConsumer(Utils.threading.Thread):
 			else:
 				tsk.process()
 
+class CacheUploader(Utils.threading.Thread):
+	"""
+	Store the outputs of the tasks in the cache (:py:meth:`waflib.Task.Task.put_files_cache`) from a thread,
+	so that the files are copied or sent over the network while the next tasks are executed (``waf --cache-async``).
+	The tasks are uploaded in the thread calling :py:meth:`waflib.Runner.CacheUploader.add` when the queue
+	is full (:py:const:`waflib.Runner.UPLOAD_QUEUE`).
+	"""
+	def __init__(self, policy, size=UPLOAD_QUEUE):
+		Utils.threading.Thread.__init__(self)
+		self.queue = Queue(size)
+		"""Tasks waiting to be uploaded, None to stop the thread"""
+
+		self.policy = policy
+		"""Upload the pending tasks at the end of the build (*flush*) or drop them (*abandon*)"""
+
+		self.lock = Utils.threading.Lock()
+		self.abandon = False
+		self.stats = {'background': [0, 0, 0.0], 'inline': [0, 0, 0.0], 'dropped': [0, 0, 0.0]}
+		"""Amount of tasks, bytes and seconds spent by kind of upload"""
+
+		self.setDaemon(1)
+		self.start()
+
+	def run(self):
+		while 1:
+			tsk = self.queue.get()
+			if tsk is None:
+				break
+			if self.abandon:
+				self.upload(tsk, 'dropped')
+			else:
+				self.upload(tsk, 'background')
+
+	def upload(self, tsk, kind):
+		"""
+		Call the method *put_files_cache* of a task and update the statistics
+		"""
+		t = time.time()
+		if kind != 'dropped':
+			try:
+				tsk.put_files_cache()
+			except Exception:
+				Logs.debug('runner: could not store the outputs of %r: %s' % (tsk, Utils.ex_stack()))
+		size = 0
+		for node in tsk.outputs:
+			try:
+				size += os.stat(node.abspath()).st_size
+			except OSError:
+				pass
+		self.lock.acquire()
+		try:
+			v = self.stats[kind]
+			v[0] += 1
+			v[1] += size
+			v[2] += time.time() - t
+		finally:
+			self.lock.release()
+
+	def add(self, tsk):
+		"""
+		Add a task to upload, called from the task consumers
+
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.Task`
+		"""
+		try:
+			self.queue.put(tsk, False)
+		except Full:
+			self.upload(tsk, 'inline')
+
+	def finish(self):
+		"""
+		Wait for the uploads to complete or drop them according to the policy, and report the statistics
+		"""
+		t = time.time()
+		if self.policy == 'abandon':
+			self.abandon = True
+		self.queue.put(None)
+		self.join()
+		waited = time.time() - t
+
+		(cnt, size, duration) = self.stats['background']
+		if cnt:
+			Logs.info('Cache uploads: %d tasks, %d bytes in the background, %.3fs hidden (%.3fs waited at the end)' % (cnt, size, max(0, duration - waited), waited))
+		(cnt, size, duration) = self.stats['inline']
+		if cnt:
+			Logs.info('Cache uploads: %d tasks, %d bytes uploaded by the task consumers (queue full)' % (cnt, size))
+		(cnt, size, duration) = self.stats['dropped']
+		if cnt:
+			Logs.info('Cache uploads: %d tasks, %d bytes abandoned' % (cnt, size))
+
+class PriorityTasks(object):
+	"""
+	Ready queue returning the tasks by decreasing :py:attr:`waflib.Task.TaskBase.tree_weight`.
+	Tasks of equal weight are returned in insertion order, so the default behaviour
+	(all weights set to 0) is the one of a simple fifo list.
+	"""
+	def __init__(self):
+		self.lst = []
+		self.seq = 0
+
+	def __len__(self):
+		return len(self.lst)
+
+	def __iter__(self):
+		for x in self.lst:
+			yield x[2]
+
+	def append(self, tsk):
+		"""
+		Add a task to the queue
+
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		"""
+		self.seq += 1
+		heapq.heappush(self.lst, (-tsk.tree_weight, self.seq, tsk))
+
+	def extend(self, lst):
+		"""
+		Add several tasks to the queue
+
+		:param lst: tasks
+		:type lst: list of :py:class:`waflib.Task.TaskBase`
+		"""
+		for x in lst:
+			self.append(x)
+
+	def insert(self, idx, tsk):
+		"""
+		Compatibility with ``list.insert(0, tsk)``: the task will be returned before all the others
+
+		:param idx: unused
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		"""
+		self.seq += 1
+		heapq.heappush(self.lst, (float('-inf'), -self.seq, tsk))
+
+	def pop(self):
+		"""
+		Remove and return the task having the highest priority
+		"""
+		return heapq.heappop(self.lst)[2]
+
 pool = Queue()
 """
 Pool of task consumer objects
@@ -114,11 +304,17 @@ class Parallel(object):
 		Instance of :py:class:`waflib.Build.BuildContext`
 		"""
 
-		self.outstanding = []
-		"""List of :py:class:`waflib.Task.TaskBase` that may be ready to be executed"""
+		self.outstanding = PriorityTasks()
+		"""Queue of :py:class:`waflib.Task.TaskBase` that may be ready to be executed, see :py:class:`waflib.Runner.PriorityTasks`"""
 
 		self.frozen = []
-		"""List of :py:class:`waflib.Task.TaskBase` that cannot be executed immediately"""
+		"""List of :py:class:`waflib.Task.TaskBase` that cannot be executed immediately for reasons unrelated to their ``run_after`` set"""
+
+		self.incomplete = {}
+		"""Tasks waiting for other tasks to complete, mapped to the amount of unfinished tasks in their ``run_after`` set"""
+
+		self.revdeps = Utils.defaultdict(set)
+		"""Reverse edges of the ``run_after`` sets: tasks mapped to the incomplete tasks waiting for them"""
 
 		self.out = Queue(0)
 		"""List of :py:class:`waflib.Task.TaskBase` returned by the task consumers"""
@@ -141,6 +337,33 @@ class Parallel(object):
 		self.dirty = False
 		"""Flag to indicate that tasks have been executed, and that the build cache must be saved (call :py:meth:`waflib.Build.BuildContext.store`)"""
 
+		self.res_used = {}
+		"""Units of resources used by the running tasks, see :py:meth:`waflib.Runner.Parallel.acquire`"""
+
+		self.res_held = {}
+		"""Running tasks mapped to the resources they hold"""
+
+		self.res_waiting = Utils.defaultdict(list)
+		"""Tasks waiting for resources, by resource pool name"""
+
+		self.limit = j
+		"""Amount of tasks executed at once, adjusted between the bounds of ``bld.jobs_auto`` by :py:meth:`waflib.Runner.Parallel.adjust_jobs`"""
+
+		self.jobs_history = []
+		"""Decisions made by :py:meth:`waflib.Runner.Parallel.adjust_jobs`, as tuples (time, load average, available memory, amount of jobs)"""
+
+		self.uploader = None
+		"""Instance of :py:class:`waflib.Runner.CacheUploader` storing the outputs in the cache in the background, if any"""
+
+		self.start_time = time.time()
+		self.last_sample = 0
+
+		self.uids = set()
+		"""Identifiers of the tasks processed, see :py:meth:`waflib.Build.BuildContext.prune`"""
+
+		self.done = []
+		"""Tasks processed, recorded for :py:meth:`waflib.Build.BuildContext.store_manifest` (``waf build --manifest``)"""
+
 	def get_next_task(self):
 		"""
 		Obtain the next task to execute.
@@ -149,15 +372,20 @@ class Parallel(object):
 		"""
 		if not self.outstanding:
 			return None
-		return self.outstanding.pop(0)
+		return self.outstanding.pop()
 
 	def postpone(self, tsk):
 		"""
-		A task cannot be executed at this point, put it in the list :py:attr:`waflib.Runner.Parallel.frozen`.
+		A task cannot be executed at this point. If some tasks in its ``run_after`` set are not complete,
+		it will be put back in :py:attr:`waflib.Runner.Parallel.outstanding` by :py:meth:`waflib.Runner.Parallel.mark_finished`,
+		else (custom :py:meth:`waflib.Task.TaskBase.runnable_status`) put it in the list :py:attr:`waflib.Runner.Parallel.frozen`
+		to ask it again later.
 
 		:param tsk: task
 		:type tsk: :py:class:`waflib.Task.TaskBase`
 		"""
+		if self.add_incomplete(tsk):
+			return
 		if random.randint(0, 1):
 			self.frozen.insert(0, tsk)
 		else:
@@ -172,7 +400,8 @@ class Parallel(object):
 
 		while not self.outstanding:
 			if self.count:
-				self.get_out()
+				if not self.add_next_group():
+					self.get_out()
 			elif self.frozen:
 				try:
 					cond = self.deadlock == self.processed
@@ -192,13 +421,420 @@ class Parallel(object):
 				self.deadlock = self.processed
 
 			if self.frozen:
-				self.outstanding += self.frozen
+				self.outstanding.extend(self.frozen)
 				self.frozen = []
-			elif not self.count:
-				self.outstanding.extend(next(self.biter))
+			elif not self.count and not self.outstanding:
+				if self.incomplete:
+					lst = []
+					for tsk in self.incomplete:
+						lst.append('%s\t-> %r' % (repr(tsk), [id(x) for x in tsk.run_after if not x.hasrun]))
+					raise Errors.WafError('Deadlock detected: check the build order for the tasks%s' % ''.join(lst))
+				tasks = next(self.biter)
+				self.hash_nodes(tasks)
+				self.scan_tasks(tasks)
+				if self.bld.critical_path:
+					self.set_tree_weights(tasks)
+				self.split_ready(tasks)
 				self.total = self.bld.total()
 				break
 
+	def hash_nodes(self, tasks):
+		"""
+		Hash the source files used by a group of tasks (inputs, dep_nodes and the dependencies found
+		by the scanners in the previous build) in the task consumer threads, before the tasks are processed.
+		The file signatures are then set on the nodes (``cache_sig``) instead of being computed one by one from the
+		main thread. This works since the hash functions release the global interpreter lock.
+
+		:param tasks: tasks of the group
+		:type tasks: list of :py:class:`waflib.Task.TaskBase`
+		"""
+		bld = self.bld
+		if self.numjobs < 2 or getattr(bld, 'bldnode', None) is getattr(bld, 'srcnode', None):
+			return
+
+		nodes = set()
+		outs = set()
+		deps = getattr(bld, 'node_deps', {})
+		for tsk in tasks:
+			nodes.update(getattr(tsk, 'inputs', []))
+			nodes.update(getattr(tsk, 'dep_nodes', []))
+			outs.update(getattr(tsk, 'outputs', []))
+			try:
+				nodes.update(deps.get(tsk.uid(), []))
+			except AttributeError:
+				pass
+		nodes -= outs
+		lst = [x for x in nodes if not hasattr(x, 'cache_sig') and not x.is_bld()]
+		if not lst:
+			return
+
+		try:
+			self.pool
+		except AttributeError:
+			self.init_task_pool()
+
+		done = Queue(0)
+		def hash_batch(batch):
+			def f(consumer):
+				try:
+					for x in batch:
+						try:
+							x.get_bld_sig()
+						except Exception:
+							# missing files are reported when the tasks are processed
+							pass
+				finally:
+					done.put(None)
+			return f
+
+		n = min(self.numjobs, len(lst))
+		for i in range(n):
+			self.ready.put(hash_batch(lst[i::n]))
+		for i in range(n):
+			done.get()
+
+	def scan_tasks(self, tasks):
+		"""
+		Call the scanners of the tasks of a group in the task consumer threads, before the tasks are processed,
+		for the tasks having no implicit dependencies from a previous build (clean builds, new tasks).
+		Only the task classes declaring :py:attr:`waflib.Task.Task.scan_in_threads` are considered, and only
+		when the tasks they wait for are complete. The results are set on the tasks (``scan_result``),
+		and :py:meth:`waflib.Task.Task.sig_implicit_deps` stores them in ``bld.node_deps`` and ``bld.raw_deps``
+		from the main thread.
+
+		:param tasks: tasks of the group
+		:type tasks: list of :py:class:`waflib.Task.TaskBase`
+		"""
+		if self.numjobs < 2:
+			return
+
+		sigs = getattr(self.bld, 'task_sigs', {})
+		lst = []
+		for tsk in tasks:
+			if not getattr(tsk, 'scan_in_threads', False) or not tsk.scan:
+				continue
+			if [x for x in tsk.run_after if not x.hasrun]:
+				continue
+			if (tsk.uid(), 'imp') not in sigs:
+				lst.append(tsk)
+		if len(lst) < 2:
+			return
+
+		try:
+			self.pool
+		except AttributeError:
+			self.init_task_pool()
+
+		done = Queue(0)
+		def scan_batch(batch):
+			def f(consumer):
+				try:
+					for tsk in batch:
+						try:
+							tsk.scan_result = tsk.scan()
+						except Exception:
+							# the errors are reported when the tasks are processed
+							pass
+				finally:
+					done.put(None)
+			return f
+
+		n = min(self.numjobs, len(lst))
+		for i in range(n):
+			self.ready.put(scan_batch(lst[i::n]))
+		for i in range(n):
+			done.get()
+
+	def add_next_group(self):
+		"""
+		Pipelined execution (``waf --pipeline``): obtain the tasks of the next build group while tasks of
+		the previous groups are still running. The new tasks are executed after the unfinished
+		tasks they share files with, or they have precedence constraints with (see :py:meth:`waflib.Runner.Parallel.set_group_constraints`),
+		and the other ones are executed immediately. The build groups then only represent ordering constraints.
+
+		:return: True if a group of tasks was added
+		:rtype: bool
+		"""
+		bld = self.bld
+		if not bld.pipeline or bld.cur >= len(bld.groups):
+			return False
+
+		prev = [x for x in bld.cur_tasks if not x.hasrun]
+		tasks = next(self.biter)
+		if not tasks:
+			return False
+
+		self.set_group_constraints(prev, tasks)
+		# used for the tasks having implicit dependencies on files created in the previous groups
+		bld.cur_tasks = prev + tasks
+
+		if bld.critical_path:
+			self.set_tree_weights(tasks)
+		self.split_ready(tasks)
+		self.total = bld.total()
+		return True
+
+	def set_group_constraints(self, prev, tasks):
+		"""
+		Add the unfinished tasks of the previous groups to the ``run_after`` sets of the new tasks
+		reading or writing their files, or having precedence constraints with them
+		(see :py:func:`waflib.Task.is_before`, in either direction since the groups must remain ordered)
+
+		:param prev: unfinished tasks of the previous groups
+		:type prev: list of :py:class:`waflib.Task.TaskBase`
+		:param tasks: tasks of the next group
+		:type tasks: list of :py:class:`waflib.Task.TaskBase`
+		"""
+		ins = Utils.defaultdict(set)
+		outs = Utils.defaultdict(set)
+		cstr_groups = Utils.defaultdict(list)
+		for x in prev:
+			for a in getattr(x, 'inputs', []) + getattr(x, 'dep_nodes', []):
+				ins[id(a)].add(x)
+			for a in getattr(x, 'outputs', []):
+				outs[id(a)].add(x)
+			cstr_groups[x.hash_constraints()].append(x)
+
+		new_groups = Utils.defaultdict(list)
+		for x in tasks:
+			for a in getattr(x, 'inputs', []) + getattr(x, 'dep_nodes', []):
+				if id(a) in outs:
+					x.run_after.update(outs[id(a)])
+			for a in getattr(x, 'outputs', []):
+				if id(a) in outs:
+					x.run_after.update(outs[id(a)])
+				if id(a) in ins:
+					x.run_after.update(ins[id(a)])
+			new_groups[x.hash_constraints()].append(x)
+
+		for lst in new_groups.values():
+			t1 = lst[0]
+			for prev_lst in cstr_groups.values():
+				t2 = prev_lst[0]
+				if Task.is_before(t2, t1) or Task.is_before(t1, t2):
+					for x in lst:
+						x.run_after.update(prev_lst)
+
+	def add_incomplete(self, tsk):
+		"""
+		Register a task waiting for the unfinished tasks of its ``run_after`` set. The task
+		is woken up by :py:meth:`waflib.Runner.Parallel.mark_finished` when the last of them completes.
+
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		:return: the amount of tasks to wait for
+		:rtype: int
+		"""
+		lst = set([x for x in getattr(tsk, 'run_after', []) if not x.hasrun])
+		for x in lst:
+			self.revdeps[x].add(tsk)
+		if lst:
+			self.incomplete[tsk] = len(lst)
+		return len(lst)
+
+	def split_ready(self, tasks):
+		"""
+		Put the tasks that have no unfinished predecessors in :py:attr:`waflib.Runner.Parallel.outstanding`,
+		and register the other ones in :py:attr:`waflib.Runner.Parallel.incomplete`
+
+		:param tasks: tasks
+		:type tasks: list of :py:class:`waflib.Task.TaskBase`
+		"""
+		for x in tasks:
+			if not self.add_incomplete(x):
+				self.outstanding.append(x)
+
+	def adjust_jobs(self):
+		"""
+		Adaptive amount of jobs (``waf -j auto``): sample the system load at most every :py:const:`waflib.Runner.AUTO_INTERVAL`
+		seconds and set :py:attr:`waflib.Runner.Parallel.limit`. The load caused by other processes is subtracted
+		from the maximum amount of jobs, and the amount of jobs is halved when less than 10% of the memory is available.
+		The amount of jobs grows by one job at most per sample, and shrinks immediately.
+		"""
+		now = time.time()
+		if now - self.last_sample < AUTO_INTERVAL:
+			return
+		self.last_sample = now
+
+		(floor, ceiling) = self.bld.jobs_auto
+		(load, avail, total) = get_system_load()
+
+		target = ceiling
+		if load is not None:
+			# the load average includes the tasks of this build
+			target = int(ceiling - max(0.0, load - self.count))
+		if avail is not None and total and avail * 10 < total:
+			target = min(target, self.limit // 2)
+
+		if target > self.limit:
+			target = self.limit + 1
+		target = max(floor, min(ceiling, target))
+
+		if target != self.limit:
+			Logs.debug('runner: jobs %d -> %d (load %r, available memory %r kB)' % (self.limit, target, load, avail))
+			self.limit = target
+			self.jobs_history.append((now - self.start_time, load, avail, target))
+
+	def store_jobs_history(self):
+		"""
+		Append the decisions made by :py:meth:`waflib.Runner.Parallel.adjust_jobs` to the file
+		:py:const:`waflib.Runner.AUTO_LOG` in the build directory
+		"""
+		lst = ['# %s jobs %d-%d\n' % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.start_time)), self.bld.jobs_auto[0], self.bld.jobs_auto[1])]
+		for x in self.jobs_history:
+			lst.append('%.3f %r %r %d\n' % x)
+		try:
+			Utils.writef(os.path.join(self.bld.variant_dir, AUTO_LOG), ''.join(lst), 'a')
+		except (IOError, OSError):
+			Logs.debug('runner: could not write %r' % AUTO_LOG)
+
+	def get_resources(self, tsk):
+		"""
+		Compute the resources required by a task from :py:attr:`waflib.Task.TaskBase.resources`
+		and :py:attr:`waflib.Task.TaskBase.max_parallel`
+
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		:return: list of tuples (pool name, units, pool capacity)
+		:rtype: list
+		"""
+		lst = []
+		limits = self.bld.resources
+		for (k, v) in getattr(tsk, 'resources', {}).items():
+			lst.append((k, v, limits.get(k, self.numjobs)))
+		if getattr(tsk, 'max_parallel', 0):
+			# the limit applies to the class declaring the attribute, and to its subclasses
+			for cls in tsk.__class__.__mro__:
+				if 'max_parallel' in cls.__dict__:
+					break
+			lst.append((cls, 1, cls.max_parallel))
+		return lst
+
+	def acquire(self, tsk):
+		"""
+		Reserve the resources required by a task before it is executed. If a pool does not have
+		enough capacity left, the task is kept aside until a task using that pool finishes,
+		and other tasks are processed in the meantime. A task requiring more units than the
+		capacity of a pool is executed alone.
+
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		:return: True if the task may be executed now
+		:rtype: bool
+		"""
+		lst = self.get_resources(tsk)
+		if not lst:
+			return True
+		for (k, v, capacity) in lst:
+			used = self.res_used.get(k, 0)
+			if used and used + v > capacity:
+				self.res_waiting[k].append(tsk)
+				return False
+		for (k, v, capacity) in lst:
+			self.res_used[k] = self.res_used.get(k, 0) + v
+		self.res_held[tsk] = lst
+		return True
+
+	def release(self, tsk):
+		"""
+		Return the resources held by a task, and put the tasks waiting for them back in the ready queue
+
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		"""
+		for (k, v, capacity) in self.res_held.pop(tsk, ()):
+			self.res_used[k] -= v
+			waiting = self.res_waiting.pop(k, None)
+			if waiting:
+				self.outstanding.extend(waiting)
+
+	def mark_finished(self, tsk):
+		"""
+		Called once a task has been executed or skipped: release its resources, record its duration,
+		and move the tasks that were waiting only for it into :py:attr:`waflib.Runner.Parallel.outstanding`
+
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		"""
+		self.release(tsk)
+
+		try:
+			# the objects returned may also be the consumer objects, see free_task_pool
+			uid = tsk.uid()
+			self.uids.add(uid)
+			# identifiers of the data used by a task compiling several files, see waflib.Tools.ccroot.apply_unity
+			self.uids.update(getattr(tsk, 'batch_uids', ()))
+			if self.bld.manifest:
+				self.done.append(tsk)
+			if tsk.hasrun == Task.SUCCESS and not getattr(tsk, 'cached', None):
+				# the tasks restored from the cache (WAFCACHE) take almost no time, keep the compilation times
+				self.bld.task_durations[uid] = tsk.duration
+		except AttributeError:
+			pass
+
+		for x in self.revdeps.pop(tsk, ()):
+			self.incomplete[x] -= 1
+			if not self.incomplete[x]:
+				del self.incomplete[x]
+				self.outstanding.append(x)
+
+	def set_tree_weights(self, tasks):
+		"""
+		Used in critical path mode (``waf --critical-path``). Set the attribute :py:attr:`waflib.Task.TaskBase.tree_weight`
+		of each task of the group to the length of the longest chain of tasks waiting on it, so that
+		the tasks starting the longest dependency chains are dispatched first.
+
+		The task durations are obtained from :py:attr:`waflib.Build.BuildContext.task_durations`;
+		tasks that were never run before are given the average duration of the group.
+
+		:param tasks: tasks of the current group
+		:type tasks: list of :py:class:`waflib.Task.TaskBase`
+		"""
+		durations = self.bld.task_durations
+		weights = {}
+		for x in tasks:
+			try:
+				weights[x] = durations[x.uid()]
+			except (AttributeError, KeyError):
+				pass
+		if weights:
+			default = sum(weights.values()) / len(weights)
+		else:
+			default = 1.0
+
+		revdeps = Utils.defaultdict(set)
+		for x in tasks:
+			for k in getattr(x, 'run_after', []):
+				revdeps[k].add(x)
+
+		# iterative depth-first traversal, the chains can be very long
+		# tasks found on the stack a second time belong to a cycle and are ignored here (deadlock detected later)
+		done = {}
+		for x in tasks:
+			if x in done:
+				continue
+			stack = [x]
+			visiting = set()
+			while stack:
+				tsk = stack[-1]
+				if tsk in done:
+					stack.pop()
+					continue
+				if tsk not in visiting:
+					visiting.add(tsk)
+					for k in revdeps.get(tsk, ()):
+						if k not in done and k not in visiting:
+							stack.append(k)
+					continue
+				stack.pop()
+				tree = 0
+				for k in revdeps.get(tsk, ()):
+					tree = max(tree, done.get(k, 0))
+				done[tsk] = weights.get(tsk, default) + tree
+
+		for x in tasks:
+			x.tree_weight = done[x]
+
 	def add_more_tasks(self, tsk):
 		"""
 		Tasks may be added dynamically during the build by binding them to the task :py:attr:`waflib.Task.TaskBase.more_tasks`
@@ -207,7 +843,7 @@ class Parallel(object):
 		:type tsk: :py:attr:`waflib.Task.TaskBase`
 		"""
 		if getattr(tsk, 'more_tasks', None):
-			self.outstanding += tsk.more_tasks
+			self.split_ready(tsk.more_tasks)
 			self.total += len(tsk.more_tasks)
 
 	def get_out(self):
@@ -220,6 +856,7 @@ class Parallel(object):
 		tsk = self.out.get()
 		if not self.stop:
 			self.add_more_tasks(tsk)
+		self.mark_finished(tsk)
 		self.count -= 1
 		self.dirty = True
 		return tsk
@@ -249,6 +886,11 @@ class Parallel(object):
 			self.pool
 		except AttributeError:
 			self.init_task_pool()
+		if getattr(tsk, 'in_process', None):
+			try:
+				self.process_pool
+			except AttributeError:
+				self.init_process_pool()
 		self.ready.put(tsk)
 
 	def init_task_pool(self):
@@ -261,6 +903,26 @@ class Parallel(object):
 			x.ready.put(setq)
 		return pool
 
+	def init_process_pool(self):
+		"""
+		Create the pool of processes executing the tasks having the attribute :py:attr:`waflib.Task.Task.in_process`.
+		The pool is created lazily from the main thread, and only if the processes can be forked
+		(the worker processes must know the task classes). The attribute ``process_pool`` is set to None otherwise.
+		"""
+		self.process_pool = None
+		if not multiprocessing or Utils.is_win32 or self.numjobs < 2:
+			return
+		try:
+			try:
+				ctx = multiprocessing.get_context('fork')
+			except AttributeError:
+				# python < 3.4, the processes are always forked on posix platforms
+				ctx = multiprocessing
+			self.process_pool = ctx.Pool(self.numjobs)
+		except (ValueError, OSError, ImportError):
+			Logs.debug('runner: cannot create a process pool')
+		return self.process_pool
+
 	def free_task_pool(self):
 		# return the consumers, setting a different queue for each of them
 		def setq(consumer):
@@ -279,6 +941,12 @@ class Parallel(object):
 				put_pool(x)
 			self.pool = []
 
+		ppool = getattr(self, 'process_pool', None)
+		if ppool:
+			ppool.close()
+			ppool.join()
+			self.process_pool = None
+
 	def start(self):
 		"""
 		Give tasks to :py:class:`waflib.Runner.TaskConsumer` instances until the build finishes or the ``stop`` flag is set.
@@ -287,6 +955,9 @@ class Parallel(object):
 
 		self.total = self.bld.total()
 
+		if getattr(self.bld, 'cache_async', None) and self.bld.cache_global and not self.bld.nocache:
+			self.uploader = CacheUploader(self.bld.cache_async)
+
 		while not self.stop:
 
 			self.refill_task_list()
@@ -304,6 +975,7 @@ class Parallel(object):
 			if tsk.hasrun:
 				# if the task is marked as "run", just skip it
 				self.processed += 1
+				self.mark_finished(tsk)
 				continue
 
 			if self.stop: # stop immediately after a failure was detected
@@ -325,6 +997,7 @@ class Parallel(object):
 					else:
 						if Logs.verbose > 1:
 							self.error.append(tsk)
+					self.mark_finished(tsk)
 					continue
 				tsk.hasrun = Task.EXCEPTION
 				self.error_handler(tsk)
@@ -336,7 +1009,16 @@ class Parallel(object):
 				self.processed += 1
 				tsk.hasrun = Task.SKIPPED
 				self.add_more_tasks(tsk)
+				self.mark_finished(tsk)
+			elif not self.acquire(tsk):
+				# the task is waiting for resources held by running tasks
+				continue
 			else:
+				if self.bld.jobs_auto:
+					self.adjust_jobs()
+					while self.count >= self.limit:
+						self.get_out()
+
 				# run me: put the task in ready queue
 				tsk.position = (self.processed, self.total)
 				self.count += 1
@@ -359,3 +1041,10 @@ class Parallel(object):
 		# free the task pool, if any
 		self.free_task_pool()
 
+		if self.uploader:
+			self.uploader.finish()
+			self.uploader = None
+
+		if self.jobs_history:
+			self.store_jobs_history()
+
@@ -260,7 +260,7 @@ def distclean_dir(dirname):
 				except OSError:
 					Logs.warn('Could not remove %r' % fname)
 
-	for x in [Context.DBFILE, 'config.log']:
+	for x in [Context.DBFILE, Context.DBFILE + Build.JOURNAL_SUFFIX, Context.DBFILE + Build.MANIFEST_SUFFIX, 'config.log']:
 		try:
 			os.remove(x)
 		except OSError:
@@ -6,9 +6,18 @@
 Tasks represent atomic operations such as processes.
 """
 
-import os, shutil, re, tempfile
+import os, shutil, re, tempfile, time
 from waflib import Utils, Logs, Errors
 
+try:
+	import zlib
+except ImportError:
+	zlib = None
+try:
+	import lzma
+except ImportError:
+	lzma = None
+
 # task states
 NOT_RUN = 0
 """The task was not executed yet"""
@@ -63,6 +72,191 @@ def f(tsk):
 	return tsk.exec_command(lst, cwd=wd, env=env.env or None)
 '''
 
+CACHE_LINKS = False
+"""
+Share the files of the cache (WAFCACHE) and of the build directory with hard links when possible
+(``waf --cache-links`` or ``WAFCACHE_LINKS=1``, not on win32). The files of the cache entries are then
+stored once by contents, in the folder *objects* of the cache.
+
+The files of the build directory then share their data with the cache: a file modified in place modifies
+the cache entries and the other build directories using it. The outputs of the tasks wrapped by
+:py:func:`waflib.Task.cache_outputs` are removed before the tasks are executed, but the tasks writing
+into the outputs of other tasks, or the task classes having the attribute 'nocache', are not protected.
+Enable the hard links only if the build files are never modified in place.
+"""
+
+CACHE_CODECS = {}
+"""
+Codecs available for compressing the files of the cache (``waf --cache-codec=name[:level]``), as a mapping
+of the codec name to a tuple (file extension, compressor factory taking the level, decompressor factory).
+The level *None* selects the default level of the codec.
+"""
+CACHE_ERRORS = (EOFError,)
+"""Exceptions raised by the decompressors on corrupt data, see :py:func:`waflib.Task.cache_unpack`"""
+if zlib:
+	CACHE_CODECS['zlib'] = ('.zlib', lambda level: zlib.compressobj(level is None and zlib.Z_DEFAULT_COMPRESSION or level), zlib.decompressobj)
+	CACHE_ERRORS += (zlib.error,)
+if lzma:
+	CACHE_CODECS['lzma'] = ('.xz', lambda level: lzma.LZMACompressor(preset=level), lzma.LZMADecompressor)
+	CACHE_ERRORS += (lzma.LZMAError,)
+
+CACHE_COMPRESS_MIN = 4096
+"""
+Files smaller than this size (in bytes) are stored uncompressed in the cache, even if a codec is set:
+the gain would be small, and the files are then shared with the build directory by hard links
+"""
+
+def cache_write(dst, fun):
+	"""
+	Create or replace the file *dst* atomically: the function *fun* is called to create the file
+	under a temporary name in the same folder, which is then renamed to *dst*
+
+	:param dst: path of the file to create or replace
+	:type dst: string
+	:param fun: function taking the temporary path as argument
+	:type fun: function
+	:return: the value returned by *fun*
+	"""
+	(fd, tmp) = tempfile.mkstemp(prefix='.waf', dir=os.path.dirname(dst))
+	os.close(fd)
+	try:
+		ret = fun(tmp)
+		try:
+			os.rename(tmp, dst)
+		except OSError:
+			# win32
+			os.remove(dst)
+			os.rename(tmp, dst)
+	except (OSError, IOError):
+		try:
+			os.remove(tmp)
+		except OSError:
+			pass
+		raise
+	return ret
+
+def cache_link(src, dst):
+	"""
+	Create the file *dst* as a hard link to *src* if possible (:py:const:`waflib.Task.CACHE_LINKS`),
+	else as a copy (:py:func:`waflib.Utils.copy_file`). The file is replaced atomically (:py:func:`waflib.Task.cache_write`).
+
+	:param src: path of an existing file
+	:type src: string
+	:param dst: path of the file to create or replace
+	:type dst: string
+	:return: True if a hard link was created
+	:rtype: bool
+	"""
+	def link(tmp):
+		if CACHE_LINKS:
+			os.remove(tmp)
+			try:
+				os.link(src, tmp)
+			except OSError:
+				pass
+			else:
+				return True
+		Utils.copy_file(src, tmp)
+		return False
+	return cache_write(dst, link)
+
+def cache_stream(src, dst, fun, end=None):
+	"""
+	Write the file *dst* from the data of *src* transformed by blocks by *fun*, followed by the data returned
+	by *end*, and copy the permissions and the timestamps of *src*; used to (de)compress the files of the cache
+	"""
+	f = open(src, 'rb')
+	try:
+		g = open(dst, 'wb')
+		try:
+			while True:
+				buf = f.read(200000)
+				if not buf:
+					break
+				g.write(fun(buf))
+			if end:
+				g.write(end())
+		finally:
+			g.close()
+	finally:
+		f.close()
+	shutil.copystat(src, dst)
+
+def cache_pack(src, dst, codec, level=None):
+	"""
+	Create the file *dst* as a compressed copy of *src*
+
+	:param codec: codec name (:py:const:`waflib.Task.CACHE_CODECS`)
+	:type codec: string
+	:param level: compression level, or None for the default of the codec
+	:type level: int
+	"""
+	def pack(tmp):
+		obj = CACHE_CODECS[codec][1](level)
+		cache_stream(src, tmp, obj.compress, obj.flush)
+	cache_write(dst, pack)
+
+def cache_unpack(src, dst, codec):
+	"""
+	Create the file *dst* from the compressed file *src*, see :py:func:`waflib.Task.cache_pack`.
+	An IOError is raised if the data is corrupt or truncated, in which case *dst* is left unchanged.
+	"""
+	def unpack(tmp):
+		obj = CACHE_CODECS[codec][2]()
+		def end():
+			eof = getattr(obj, 'eof', None)
+			if eof is None:
+				# python < 3.3: the data passed after the end of the stream is kept in unused_data
+				sep = '\x00'.encode()
+				obj.decompress(sep)
+				eof = obj.unused_data == sep
+			elif obj.unused_data:
+				eof = False
+			if not eof:
+				raise IOError('corrupt cache file %r' % src)
+			try:
+				return obj.flush()
+			except AttributeError:
+				# the lzma decompressors have no flush method
+				return ''.encode()
+		try:
+			cache_stream(src, tmp, obj.decompress, end)
+		except CACHE_ERRORS as e:
+			raise IOError('corrupt cache file %r: %r' % (src, e))
+	cache_write(dst, unpack)
+
+def cache_store(cache_dir, path, codec=None, level=None):
+	"""
+	Add a file to the folder *objects* of the cache, in which the files are stored by contents
+	(hash of the file), and return the path of the copy. If a codec is given, the copy is compressed,
+	and its name ends with the file extension of the codec.
+
+	:param cache_dir: cache folder
+	:type cache_dir: string
+	:param path: file to add
+	:type path: string
+	:param codec: codec name (:py:const:`waflib.Task.CACHE_CODECS`), or None
+	:type codec: string
+	:param level: compression level
+	:type level: int
+	:rtype: string
+	"""
+	name = Utils.to_hex(Utils.h_file(path))
+	dname = os.path.join(cache_dir, 'objects', name[:2])
+	ret = os.path.join(dname, name)
+	if codec:
+		ret += CACHE_CODECS[codec][0]
+	if not os.path.isfile(ret):
+		try:
+			os.makedirs(dname)
+		except OSError:
+			pass
+		if codec:
+			cache_pack(path, ret, codec, level)
+		else:
+			cache_link(path, ret)
+	return ret
+
 def cache_outputs(cls):
 	"""
 	Task class decorator applied to all task classes by default unless they define the attribute 'nocache'::
@@ -74,28 +268,120 @@ def cache_outputs(cls):
 	If bld.cache_global is defined and if the task instances produces output nodes,
 	the files will be copied into a folder in the cache directory
 
-	The files may also be retrieved from that folder, if it exists
+	The files may also be retrieved from that folder, if it exists.
+	The methods inherited from a parent class are already wrapped, and are left unchanged.
 	"""
 	m1 = cls.run
+	if getattr(m1, 'cache_outputs', None):
+		return cls
 	def run(self):
 		bld = self.generator.bld
 		if bld.cache_global and not bld.nocache:
 			if self.can_retrieve_cache():
 				return 0
+		if bld.cache_global:
+			# the files shared with the cache must not be modified in place (CACHE_LINKS)
+			for node in self.outputs:
+				try:
+					if os.stat(node.abspath()).st_nlink > 1:
+						os.remove(node.abspath())
+				except OSError:
+					pass
 		return m1(self)
+	run.cache_outputs = True
 	cls.run = run
 
 	m2 = cls.post_run
-	def post_run(self):
-		bld = self.generator.bld
-		ret = m2(self)
-		if bld.cache_global and not bld.nocache:
-			self.put_files_cache()
-		return ret
-	cls.post_run = post_run
+	if not getattr(m2, 'cache_outputs', None):
+		def post_run(self):
+			bld = self.generator.bld
+			ret = m2(self)
+			# the method post_run of a subclass may call the method of a parent class, wrapped too
+			if bld.cache_global and not bld.nocache and not getattr(self, 'cache_stored', None):
+				self.cache_stored = True
+				uploader = getattr(getattr(self, 'master', None), 'uploader', None)
+				if uploader and not getattr(self, 'cached', None):
+					# waf --cache-async
+					uploader.add(self)
+				else:
+					self.put_files_cache()
+			return ret
+		post_run.cache_outputs = True
+		cls.post_run = post_run
 
 	return cls
 
+def run_in_process(cls):
+	"""
+	Task class decorator applied to the classes having the attribute 'in_process' and defining a method
+	'run_job'. The method 'run' is replaced by a function sending the data returned by
+	:py:meth:`waflib.Task.Task.get_job` to the pool of processes of the build (:py:attr:`waflib.Runner.Parallel.process_pool`).
+	Pure-python tasks are then executed in parallel without being serialized by the global interpreter lock::
+
+		from waflib import Task
+		class foo(Task.Task):
+			in_process = True
+			def get_job(self):
+				return (self.inputs[0].abspath(), self.outputs[0].abspath())
+			@staticmethod
+			def run_job(job):
+				(src, tgt) = job
+				...
+				return 0
+
+	The original method 'run' is used when there is no process pool (single job, no fork support)
+	or when 'get_job' returns None.
+	"""
+	m1 = cls.run
+	def run(self):
+		pool = getattr(getattr(self, 'master', None), 'process_pool', None)
+		if not pool:
+			return m1(self)
+		job = self.get_job()
+		if job is None:
+			return m1(self)
+
+		outputs = self.hash_outputs and [x.abspath() for x in self.outputs] or []
+		ret = pool.apply(process_job, (self.__class__.__name__, job, outputs))
+		if ret is None:
+			# the class is unknown to the worker processes (created after they were forked)
+			return m1(self)
+		(ret, sigs, err) = ret
+		if err:
+			raise Errors.WafError('Execution failure in a worker process: %s' % err)
+		self.output_sigs = sigs
+		return self.set_job_result(ret)
+	cls.run = run
+	cls.hcode = cls.hcode + Utils.h_fun(cls.run_job)
+	return cls
+
+def process_job(name, job, outputs):
+	"""
+	Executed in the worker processes of :py:attr:`waflib.Runner.Parallel.process_pool`, see :py:func:`waflib.Task.run_in_process`.
+	The output files given are hashed in the worker too (:py:attr:`waflib.Task.Task.hash_outputs`).
+
+	:param name: task class name
+	:type name: string
+	:param job: data returned by :py:meth:`waflib.Task.Task.get_job`
+	:param outputs: absolute paths of the task outputs to hash
+	:type outputs: list of string
+	:return: a tuple (value returned by run_job, output file hashes, error message) or None if the class is unknown
+	:rtype: tuple
+	"""
+	try:
+		cls = classes[name]
+	except KeyError:
+		return None
+	try:
+		ret = cls.run_job(job)
+	except Exception:
+		return (None, None, Utils.ex_stack())
+	try:
+		sigs = [Utils.h_file(x) for x in outputs]
+	except (IOError, OSError):
+		sigs = None
+	return (ret, sigs, None)
+
 
 classes = {}
 "class tasks created by user scripts or Waf tools are kept in this dict name -> class object"
@@ -105,6 +391,7 @@ class store_task_type(type):
 	Metaclass: store the task classes into :py:const:`waflib.Task.classes`, or to the dict pointed
 	by the class attribute 'register'.
 	The attribute 'run_str' will be processed to compute a method 'run' on the task class
+	The decorator :py:func:`waflib.Task.run_in_process` is applied to the classes having the attribute 'in_process'
 	The decorator :py:func:`waflib.Task.cache_outputs` is also applied to the class
 	"""
 	def __init__(cls, name, bases, dict):
@@ -128,6 +415,9 @@ class store_task_type(type):
 				# getattr(cls, 'hcode') would look in the upper classes
 				cls.hcode = Utils.h_fun(cls.run)
 
+			if getattr(cls, 'in_process', None) and 'run_job' in cls.__dict__:
+				cls = run_in_process(cls)
+
 			if not getattr(cls, 'nocache', None):
 				cls = cache_outputs(cls)
 
@@ -170,6 +460,23 @@ class TaskBase(evil):
 	hcode = ''
 	"""String representing an additional hash for the class representation"""
 
+	tree_weight = 0
+	"""Priority of the task in the ready queue, set by :py:meth:`waflib.Runner.Parallel.set_tree_weights` (critical path mode)"""
+
+	resources = {}
+	"""
+	Units of resources used by the instances of this class, for example ``{'mem': 4}``. The capacity of each
+	pool is read from :py:attr:`waflib.Build.BuildContext.resources` (default: amount of jobs)::
+
+		def build(bld):
+			bld.resources['mem'] = 16 # at most 4 link tasks at once
+			from waflib.Tools import ccroot
+			ccroot.link_task.resources = {'mem': 4}
+	"""
+
+	max_parallel = 0
+	"""Maximum amount of instances of the class declaring this attribute (subclasses included) that may run at once, 0 for no limit"""
+
 	def __init__(self, *k, **kw):
 		"""
 		The base task class requires a task generator, which will be itself if missing
@@ -238,7 +545,9 @@ class TaskBase(evil):
 		try:
 			self.generator.bld.returned_tasks.append(self)
 			self.log_display(self.generator.bld)
+			t1 = time.time()
 			ret = self.run()
+			self.duration = time.time() - t1
 		except Exception:
 			self.err_msg = Utils.ex_stack()
 			self.hasrun = EXCEPTION
@@ -410,6 +719,15 @@ class Task(TaskBase):
 	shell = False
 	"""Execute the command with the shell (class attribute)"""
 
+	in_process = False
+	"""Execute the static method 'run_job' in a pool of processes, see :py:func:`waflib.Task.run_in_process` (class attribute)"""
+
+	hash_outputs = False
+	"""Hash the outputs in the worker process after 'run_job', set by :py:func:`waflib.Task.update_outputs` (class attribute)"""
+
+	scan_in_threads = False
+	"""The method 'scan' is thread-safe and may be called before the task is processed, see :py:meth:`waflib.Runner.Parallel.scan_tasks` (class attribute)"""
+
 	def __init__(self, *k, **kw):
 		TaskBase.__init__(self, *k, **kw)
 
@@ -510,6 +828,27 @@ class Task(TaskBase):
 		assert isinstance(task, TaskBase)
 		self.run_after.add(task)
 
+	def get_job(self):
+		"""
+		Return the picklable data given to the static method 'run_job' in a worker process
+		(see :py:func:`waflib.Task.run_in_process`), or None to execute the method 'run' in the current process.
+		By default: the input file paths, the output file paths and the values of the variables in *vars*.
+
+		:rtype: tuple
+		"""
+		dct = dict((x, self.env[x]) for x in self.vars + getattr(self, 'dep_vars', []))
+		return ([x.abspath() for x in self.inputs], [x.abspath() for x in self.outputs], dct)
+
+	def set_job_result(self, ret):
+		"""
+		Process the value returned by the static method 'run_job' once back in the current process
+
+		:param ret: value returned by 'run_job'
+		:return: the task exit status
+		:rtype: int
+		"""
+		return ret
+
 	def signature(self):
 		"""
 		Task signatures are stored between build executions, they are use to track the changes
@@ -732,7 +1071,13 @@ class Task(TaskBase):
 			raise Errors.TaskRescan('rescan')
 
 		# no previous run or the signature of the dependencies has changed, rescan the dependencies
-		(nodes, names) = self.scan()
+		try:
+			# obtained in advance by waflib.Runner.Parallel.scan_tasks
+			(nodes, names) = self.scan_result
+		except AttributeError:
+			(nodes, names) = self.scan()
+		else:
+			del self.scan_result
 		if Logs.verbose:
 			Logs.debug('deps: scanner for %s returned %s %s' % (str(self), str(nodes), str(names)))
 
@@ -816,13 +1161,13 @@ class Task(TaskBase):
 		Used by :py:meth:`waflib.Task.cache_outputs`
 
 		Retrieve build nodes from the cache
-		update the file timestamps to help cleaning the least used entries from the cache
+		update the folder timestamps to help cleaning the least used entries from the cache
 		additionally, set an attribute 'cached' to avoid re-creating the same cache files
 
 		Suppose there are files in `cache/dir1/file1` and `cache/dir2/file2`:
 
 		#. read the timestamp of dir1
-		#. try to copy the files
+		#. try to link or to copy the files (:py:func:`waflib.Task.cache_link`), or to decompress them (:py:func:`waflib.Task.cache_unpack`)
 		#. look at the timestamp again, if it has changed, the data may have been corrupt (cache update by another process)
 		#. should an exception occur, ignore the data
 		"""
@@ -840,12 +1185,24 @@ class Task(TaskBase):
 		except OSError:
 			return None
 
+		try:
+			names = set(os.listdir(dname))
+		except OSError:
+			return None
+
 		for node in self.outputs:
 			orig = os.path.join(dname, node.name)
 			try:
-				shutil.copy2(orig, node.abspath())
-				# mark the cache file as used recently (modified)
-				os.utime(orig, None)
+				if node.name in names:
+					cache_link(orig, node.abspath())
+				else:
+					# compressed file, see put_files_cache
+					for (codec, (ext, _, _)) in CACHE_CODECS.items():
+						if node.name + ext in names:
+							cache_unpack(orig + ext, node.abspath(), codec)
+							break
+					else:
+						raise IOError('missing file %r' % orig)
 			except (OSError, IOError):
 				Logs.debug('task: failed retrieving file')
 				return None
@@ -859,6 +1216,12 @@ class Task(TaskBase):
 		if t1 != t2:
 			return None
 
+		try:
+			# mark the entry as used recently (modified)
+			os.utime(dname, None)
+		except OSError:
+			pass
+
 		for node in self.outputs:
 			node.sig = sig
 			if self.generator.bld.progress_bar < 1:
@@ -879,10 +1242,32 @@ class Task(TaskBase):
 		if not getattr(self, 'outputs', None):
 			return None
 
+		# tuple (codec name, level), see the option --cache-codec
+		(codec, level) = getattr(self.generator.bld, 'cache_codec', None) or (None, None)
+
+		# the signature of the task may have been updated after it was executed (dependencies
+		# returned by the compilers), the files are also stored under the previous signatures
 		sig = self.signature()
-		ssig = Utils.to_hex(self.uid()) + Utils.to_hex(sig)
+		for x in [sig] + [y for y in getattr(self, 'cache_aliases', []) if y != sig]:
+			self.put_files_entry(Utils.to_hex(self.uid()) + Utils.to_hex(x), codec, level)
+
+	def put_files_entry(self, ssig, codec=None, level=None):
+		"""
+		Used by :py:meth:`waflib.Task.Task.put_files_cache` to store the build files in a folder of the cache
+
+		:param ssig: name of the folder
+		:type ssig: string
+		:param codec: codec name (:py:const:`waflib.Task.CACHE_CODECS`), or None
+		:type codec: string
+		:param level: compression level
+		:type level: int
+		:return: the paths of the files of the folder *objects* shared with the new folder (:py:func:`waflib.Task.cache_store`),
+			or None if the folder could not be created
+		:rtype: list of string
+		"""
 		dname = os.path.join(self.generator.bld.cache_global, ssig)
 		tmpdir = tempfile.mkdtemp(prefix=self.generator.bld.cache_global + os.sep + 'waf')
+		objects = []
 
 		try:
 			shutil.rmtree(dname)
@@ -891,8 +1276,21 @@ class Task(TaskBase):
 
 		try:
 			for node in self.outputs:
+				src = node.abspath()
 				dest = os.path.join(tmpdir, node.name)
-				shutil.copy2(node.abspath(), dest)
+				pack = codec and os.stat(src).st_size >= CACHE_COMPRESS_MIN and codec or None
+				if pack:
+					# the compressed files are recognized by their extension
+					dest += CACHE_CODECS[pack][0]
+				if CACHE_LINKS:
+					# the identical files are stored once
+					obj = cache_store(self.generator.bld.cache_global, src, pack, level)
+					if cache_link(obj, dest):
+						objects.append(obj)
+				elif pack:
+					cache_pack(src, dest, pack, level)
+				else:
+					Utils.copy_file(src, dest)
 		except (OSError, IOError):
 			try:
 				shutil.rmtree(tmpdir)
@@ -911,6 +1309,8 @@ class Task(TaskBase):
 					os.chmod(dname, Utils.O755)
 				except Exception:
 					pass
+				return objects
+		return None
 
 def is_before(t1, t2):
 	"""
@@ -1211,10 +1611,13 @@ def update_outputs(cls):
 	old_post_run = cls.post_run
 	def post_run(self):
 		old_post_run(self)
-		for node in self.outputs:
-			node.sig = Utils.h_file(node.abspath())
+		# the outputs may have been hashed already in a worker process
+		sigs = getattr(self, 'output_sigs', None) or [Utils.h_file(x.abspath()) for x in self.outputs]
+		for (node, sig) in zip(self.outputs, sigs):
+			node.sig = sig
 			self.generator.bld.task_sigs[node.abspath()] = self.uid() # issue #1017
 	cls.post_run = post_run
+	cls.hash_outputs = True
 
 
 	old_runnable_status = cls.runnable_status
@@ -224,6 +224,15 @@ class task_gen(object):
 			Logs.debug('task_gen: -> %s (%d)' % (x, id(self)))
 			v()
 
+		# load the dependencies of the tasks created, see waflib.Build.BuildContext.load_deps
+		try:
+			get_shard = self.bld.get_deps_shard
+		except AttributeError:
+			pass
+		else:
+			for tsk in self.tasks:
+				self.bld.load_deps(get_shard(tsk))
+
 		Logs.debug('task_gen: posted %s' % self.name)
 		return True
 
@@ -657,27 +666,91 @@ class subst_pc(Task.Task):
 	in the substitution changes.
 	"""
 
+	in_process = True
+
 	def run(self):
 		"Substitutes variables in a .in file"
 
-		if getattr(self.generator, 'is_copy', None):
-			self.outputs[0].write(self.inputs[0].read('rb'), 'wb')
-			if getattr(self.generator, 'chmod', None):
-				os.chmod(self.outputs[0].abspath(), self.generator.chmod)
+		if not getattr(self.generator, 'is_copy', None):
+			if getattr(self.generator, 'fun', None):
+				return self.generator.fun(self)
+
+			if getattr(self.generator, 'subst_fun', None):
+				code = self.inputs[0].read(encoding=getattr(self.generator, 'encoding', 'ISO8859-1'))
+				code = self.generator.subst_fun(self, code)
+				if code is not None:
+					self.outputs[0].write(code, encoding=getattr(self.generator, 'encoding', 'ISO8859-1'))
+				return
+
+		return self.set_job_result(self.run_job(self.get_job()))
+
+	def get_vars(self, names):
+		"""
+		Values of the variables used in the substitution, from the task generator attributes or from the environment
+
+		:param names: variable names
+		:type names: list of string
+		:rtype: dict
+		"""
+		gen = self.generator
+		d = {}
+		for x in names:
+			tmp = getattr(gen, x, '') or self.env.get_flat(x) or self.env.get_flat(x.upper())
+			d[x] = str(tmp)
+		return d
+
+	def get_job(self, names=None):
+		"""
+		Collect the data for :py:meth:`waflib.TaskGen.subst_pc.run_job`, which may then be executed in
+		a worker process, where the file is read and the variables are substituted. The user functions
+		*fun* and *subst_fun* are executed in the current process.
+
+		The values of the variables are obtained here. The names are given by the attribute *dct*,
+		or are the ones found in the previous build (*raw_deps*); when the file uses other variables,
+		*run_job* returns their names, and the substitution is performed again with their values
+		(:py:meth:`waflib.TaskGen.subst_pc.set_job_result`).
+
+		:param names: the names of all the variables used in the file, if known
+		:type names: list of string
+		"""
+		gen = self.generator
+		is_copy = getattr(gen, 'is_copy', None)
+		if not is_copy and (getattr(gen, 'fun', None) or getattr(gen, 'subst_fun', None)):
 			return None
 
-		if getattr(self.generator, 'fun', None):
-			return self.generator.fun(self)
+		global re_m4
+		d = None
+		complete = True
+		if not is_copy:
+			try:
+				d = gen.dct
+			except AttributeError:
+				if names is None:
+					complete = False
+					names = gen.bld.raw_deps.get(self.uid(), [])
+				d = self.get_vars(names)
 
-		code = self.inputs[0].read(encoding=getattr(self.generator, 'encoding', 'ISO8859-1'))
-		if getattr(self.generator, 'subst_fun', None):
-			code = self.generator.subst_fun(self, code)
-			if code is not None:
-				self.outputs[0].write(code, encoding=getattr(self.generator, 'encoding', 'ISO8859-1'))
-			return
+		return (self.inputs[0].abspath(), self.outputs[0].abspath(), getattr(gen, 'encoding', 'ISO8859-1'),
+			getattr(gen, 'chmod', None), is_copy, getattr(gen, 're_m4', re_m4), d, complete)
+
+	@staticmethod
+	def run_job(job):
+		"""
+		Copy the file or substitute the variables
+
+		:return: a tuple (variables used or None for copies, True if the file was written)
+		:rtype: tuple
+		"""
+		(src, tgt, encoding, chmod, is_copy, pattern, d, complete) = job
+
+		if is_copy:
+			Utils.writef(tgt, Utils.readf(src, 'rb'), 'wb')
+			if chmod:
+				os.chmod(tgt, chmod)
+			return (None, True)
 
 		# replace all % by %% to prevent errors by % signs
-		code = code.replace('%', '%%')
+		code = Utils.readf(src, encoding=encoding).replace('%', '%%')
 
 		# extract the vars foo into lst and replace @foo@ by %(foo)s
 		lst = []
@@ -687,27 +760,35 @@ class subst_pc(Task.Task):
 				lst.append(g(1))
 				return "%%(%s)s" % g(1)
 			return ''
-		global re_m4
-		code = getattr(self.generator, 're_m4', re_m4).sub(repl, code)
+		code = pattern.sub(repl, code)
 
-		try:
-			d = self.generator.dct
-		except AttributeError:
-			d = {}
+		if not complete:
 			for x in lst:
-				tmp = getattr(self.generator, x, '') or self.env.get_flat(x) or self.env.get_flat(x.upper())
-				d[x] = str(tmp)
+				if not x in d:
+					# the values are obtained by the caller
+					return (lst, False)
 
 		code = code % d
-		self.outputs[0].write(code, encoding=getattr(self.generator, 'encoding', 'ISO8859-1'))
-		self.generator.bld.raw_deps[self.uid()] = self.dep_vars = lst
+		Utils.writef(tgt, code, encoding=encoding)
+		if chmod:
+			os.chmod(tgt, chmod)
+		return (lst, True)
+
+	def set_job_result(self, ret):
+		"""
+		Store the list of variables used by the substitution, or perform the substitution
+		again when the values of some variables were missing (:py:meth:`waflib.TaskGen.subst_pc.get_job`)
+		"""
+		(lst, done) = ret
+		if not done:
+			return self.set_job_result(self.run_job(self.get_job(lst)))
 
-		# make sure the signature is updated
-		try: delattr(self, 'cache_sig')
-		except AttributeError: pass
+		if lst is not None:
+			self.generator.bld.raw_deps[self.uid()] = self.dep_vars = lst
 
-		if getattr(self.generator, 'chmod', None):
-			os.chmod(self.outputs[0].abspath(), self.generator.chmod)
+			# make sure the signature is updated
+			try: delattr(self, 'cache_sig')
+			except AttributeError: pass
 
 	def sig_vars(self):
 		"""
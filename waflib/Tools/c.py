@@ -6,19 +6,30 @@
 
 from waflib import TaskGen, Task, Utils
 from waflib.Tools import c_preproc
-from waflib.Tools.ccroot import link_task, stlink_task
+from waflib.Tools.ccroot import link_task, stlink_task, compile_task
 
 @TaskGen.extension('.c')
 def c_hook(self, node):
 	"Bind the c file extension to the creation of a :py:class:`waflib.Tools.c.c` instance"
 	return self.create_compiled_task('c', node)
 
-class c(Task.Task):
+class c(compile_task):
 	"Compile C files into object files"
-	run_str = '${CC} ${ARCH_ST:ARCH} ${CFLAGS} ${CPPFLAGS} ${FRAMEWORKPATH_ST:FRAMEWORKPATH} ${CPPPATH_ST:INCPATHS} ${DEFINES_ST:DEFINES} ${CC_SRC_F}${SRC} ${CC_TGT_F}${TGT}'
+	run_str = '${CC} ${ARCH_ST:ARCH} ${CFLAGS} ${CPPFLAGS} ${FRAMEWORKPATH_ST:FRAMEWORKPATH} ${CPPPATH_ST:INCPATHS} ${DEFINES_ST:DEFINES} ${CC_DEPS_F} ${CC_SRC_F}${SRC} ${CC_TGT_F}${TGT}'
 	vars    = ['CCDEPS'] # unused variable to depend on, just in case
 	ext_in  = ['.h'] # set the build order easily by using ext_out=['.h']
-	scan    = c_preproc.scan
+	deps_var = 'CC_DEPS_F'
+	pch_task = 'c_pch'
+	flags_var = 'CFLAGS'
+	unity_ext = '.c'
+
+class c_pch(compile_task):
+	"Compile a header into a precompiled header, see :py:func:`waflib.Tools.ccroot.apply_pch`"
+	run_str = '${CC} ${ARCH_ST:ARCH} ${CFLAGS} ${CPPFLAGS} ${FRAMEWORKPATH_ST:FRAMEWORKPATH} ${CPPPATH_ST:INCPATHS} ${DEFINES_ST:DEFINES} ${CC_DEPS_F} ${CCPCH_F} ${CC_SRC_F}${SRC} ${CC_TGT_F}${TGT}'
+	ext_in  = ['.h']
+	color   = 'BLUE'
+	deps_var = 'CC_DEPS_F'
+	flags_var = 'CFLAGS'
 
 class cprogram(link_task):
 	"Link object files into a c program"
@@ -745,6 +745,7 @@ def run_c_code(self, *k, **kw):
 	bld.init_dirs()
 	bld.progress_bar = 0
 	bld.targets = '*'
+	bld.manifest = bld.task_graph = False
 
 	if kw['compile_filename']:
 		node = bld.srcnode.make_node(kw['compile_filename'])
@@ -1220,6 +1221,12 @@ def multicheck(self, *k, **kw):
 			self.keep = False
 			self.cache_global = Options.cache_global
 			self.nocache = Options.options.nocache
+			self.cache_codec = Options.options.cache_codec
+			self.critical_path = False
+			self.pipeline = False
+			self.manifest = False
+			self.jobs_auto = None
+			self.resources = {}
 			self.returned_tasks = []
 			self.task_sigs = {}
 		def total(self):
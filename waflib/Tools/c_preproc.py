@@ -26,8 +26,8 @@ A dumb preprocessor is also available in the tool *c_dumbpreproc*
 """
 # TODO: more varargs, pragma once
 
-import re, string, traceback
-from waflib import Logs, Utils, Errors
+import os, re, sys, string, struct, time, traceback
+from waflib import Logs, Utils, Errors, Context, Build
 from waflib.Logs import debug, error
 
 class PreprocError(Errors.WafError):
@@ -36,6 +36,9 @@ class PreprocError(Errors.WafError):
 POPFILE = '-'
 "Constant representing a special token used in :py:meth:`waflib.Tools.c_preproc.c_parser.start` iteration to switch to a header read previously"
 
+MEMOFILE = '+'
+"Constant representing a special token used in :py:meth:`waflib.Tools.c_preproc.c_parser.start` iteration to process a header found, see :py:meth:`waflib.Tools.c_preproc.c_parser.include`"
+
 recursion_limit = 150
 "Limit on the amount of files to read in the dependency scanner"
 
@@ -52,6 +55,21 @@ use_trigraphs = 0
 strict_quotes = 0
 """Reserve the "#include <>" quotes for system includes (do not search for those includes). False by default."""
 
+use_lines_cache = True
+"""Keep the preprocessor lines of the files read for the next builds, see :py:class:`waflib.Tools.c_preproc.lines_cache`"""
+
+lines_cache_size = 20000
+"""Maximum amount of files in the cache of preprocessor lines, the least recently used ones are removed first"""
+
+LINES_CACHE_SUFFIX = '.preproc'
+"""Suffix added to :py:const:`waflib.Context.DBFILE` for the cache of preprocessor lines"""
+
+use_include_memo = True
+"""Reuse the results of the headers included again with the same macro values, see :py:class:`waflib.Tools.c_preproc.include_frame`"""
+
+include_memo_size = 8
+"""Maximum amount of results kept per header and per list of include paths"""
+
 g_optrans = {
 'not':'!',
 'and':'&&',
@@ -157,6 +175,229 @@ def filter_comments(filename):
 	code = re_cpp.sub(repl, code)
 	return [(m.group(2), m.group(3)) for m in re.finditer(re_lines, code)]
 
+if sys.hexversion > 0x3000000:
+	def encode_text(txt):
+		return txt.encode('ISO8859-1')
+	def decode_text(data):
+		return data.decode('ISO8859-1')
+	def encode_path(path):
+		return path.encode('utf-8', 'surrogateescape')
+	def decode_path(data):
+		return data.decode('utf-8', 'surrogateescape')
+else:
+	def encode_text(txt):
+		return txt
+	decode_text = encode_path = decode_path = encode_text
+
+class lines_cache(object):
+	"""
+	Persistent cache of the lines returned by :py:func:`waflib.Tools.c_preproc.filter_comments`, so that
+	the files included (system headers in particular) are not read and filtered again in the next builds.
+	The entries are keyed by file path and by file status (modification time, size and inode), and
+	the entries that were not used for the longest time are removed first when there are more than
+	:py:attr:`waflib.Tools.c_preproc.lines_cache_size` files.
+
+	The file contains a header, an index with one record per file, and the lines. It is memory-mapped,
+	so only the index is read when the build starts, and the lines are only decoded when used.
+	"""
+
+	HEADER = struct.Struct('<4sIII')
+	"""Magic, format version, generation (incremented on each write) and amount of records"""
+
+	RECORD = struct.Struct('<qqqIQIH')
+	"""File status (modification time, size, inode), last generation used, offset and length of the lines, length of the path"""
+
+	MAGIC = 'wppc'.encode()
+	VERSION = 1
+
+	def __init__(self, path):
+		self.path = path
+
+		self.data = None
+		"""Contents of the cache file (memory-mapped if possible)"""
+
+		self.base = 0
+		"""Position of the lines in the file, after the index"""
+
+		self.index = {}
+		"""Records read from the file: path -> (file status, generation, offset, length)"""
+
+		self.added = {}
+		"""Entries added during the build: path -> (file status, lines)"""
+
+		self.used = set()
+		"""Paths of the records used during the build"""
+
+		self.gen = 0
+		"""Generation of the current build"""
+
+		try:
+			self.load()
+		except (IOError, OSError, ValueError, struct.error) as e:
+			Logs.debug('preproc: could not read the cache %s: %r' % (path, e))
+			self.close()
+			self.index = {}
+			self.gen = 0
+
+	def load(self):
+		"Read the header and the index, the lines are decoded by :py:meth:`waflib.Tools.c_preproc.lines_cache.get`"
+		try:
+			f = open(self.path, 'rb')
+		except (IOError, OSError):
+			return
+		try:
+			if Utils.mmap and os.fstat(f.fileno()).st_size:
+				self.data = Utils.mmap.mmap(f.fileno(), 0, access=Utils.mmap.ACCESS_READ)
+			else:
+				self.data = f.read()
+		finally:
+			f.close()
+
+		data = self.data
+		(magic, version, gen, count) = self.HEADER.unpack_from(data, 0)
+		if magic != self.MAGIC or version != self.VERSION:
+			raise ValueError('unsupported cache format')
+		self.gen = gen + 1
+
+		pos = self.HEADER.size
+		size = self.RECORD.size
+		index = self.index
+		for i in range(count):
+			(mtime, st_size, ino, used, offset, length, plen) = self.RECORD.unpack_from(data, pos)
+			pos += size
+			index[decode_path(data[pos:pos + plen])] = ((mtime, st_size, ino), used, offset, length)
+			pos += plen
+		self.base = pos
+
+	def close(self):
+		"Release the memory-mapped file"
+		try:
+			self.data.close()
+		except AttributeError:
+			pass
+		self.data = None
+
+	def get(self, filepath):
+		"""
+		:param filepath: absolute path of the file to read
+		:type filepath: string
+		:return: the file status, and the lines of the file if the cache is valid; the status is None
+			for the files modified less than :py:attr:`waflib.Build.HASH_DELAY` seconds before, which
+			may still change within the resolution of the timestamps and are not cached
+		:rtype: tuple
+		"""
+		try:
+			st = os.stat(filepath)
+		except OSError:
+			return (None, None)
+		if st.st_mtime >= time.time() - Build.HASH_DELAY:
+			return (None, None)
+		try:
+			mtime = st.st_mtime_ns
+		except AttributeError:
+			mtime = int(st.st_mtime * 1000000000)
+		sig = (mtime, st.st_size, st.st_ino)
+
+		try:
+			(prev, used, offset, length) = self.index[filepath]
+		except KeyError:
+			return (sig, None)
+		if prev != sig:
+			return (sig, None)
+
+		self.used.add(filepath)
+		offset += self.base
+		txt = decode_text(self.data[offset:offset + length])
+		if not txt:
+			return (sig, [])
+		return (sig, [tuple(x.split('\x00', 1)) for x in txt.split('\n')])
+
+	def set(self, filepath, sig, lines):
+		"""
+		Add the lines of a file to the cache
+
+		:param filepath: absolute path of the file read
+		:type filepath: string
+		:param sig: file status returned by :py:meth:`waflib.Tools.c_preproc.lines_cache.get`
+		:type sig: tuple
+		:param lines: lines returned by :py:func:`waflib.Tools.c_preproc.filter_comments`
+		:type lines: list of string pairs
+		"""
+		if sig is None:
+			return
+		for (kw, line) in lines:
+			if '\x00' in line or '\n' in line:
+				# these are the separators used in the file
+				return
+		self.added[filepath] = (sig, lines)
+
+	def store(self):
+		"""
+		Write the entries used or added during the build and the most recent entries of the previous builds,
+		up to :py:attr:`waflib.Tools.c_preproc.lines_cache_size` entries
+		"""
+		if not self.added and not self.used:
+			return
+
+		entries = []
+		for (path, (sig, used, offset, length)) in self.index.items():
+			if path in self.added:
+				continue
+			if path in self.used:
+				used = self.gen
+			offset += self.base
+			entries.append((used, path, sig, self.data[offset:offset + length]))
+		for (path, (sig, lines)) in self.added.items():
+			txt = '\n'.join(['%s\x00%s' % x for x in lines])
+			entries.append((self.gen, path, sig, encode_text(txt)))
+
+		# least recently used entries last
+		entries.sort(key=lambda x: -x[0])
+		del entries[lines_cache_size:]
+
+		buf = [self.HEADER.pack(self.MAGIC, self.VERSION, self.gen, len(entries))]
+		offset = 0
+		for (used, path, sig, blob) in entries:
+			path = encode_path(path)
+			buf.append(self.RECORD.pack(sig[0], sig[1], sig[2], used, offset, len(blob), len(path)))
+			buf.append(path)
+			offset += len(blob)
+		buf.extend([x[3] for x in entries])
+		data = ''.encode().join(buf)
+
+		self.close()
+		tmp = self.path + '.tmp'
+		Utils.writef(tmp, data, m='wb')
+		os.rename(tmp, self.path)
+
+lock = Utils.threading.Lock()
+"""Lock for the data shared by the parsers, which may run in several threads"""
+
+def get_lines_cache(bld):
+	"""
+	Return the cache of preprocessor lines of a build context, it is created on first use and written
+	after the build by :py:meth:`waflib.Tools.c_preproc.lines_cache.store`
+
+	:param bld: build context
+	:type bld: :py:class:`waflib.Build.BuildContext`
+	:rtype: :py:class:`waflib.Tools.c_preproc.lines_cache` or None
+	"""
+	try:
+		return bld.lines_cache
+	except AttributeError:
+		pass
+	lock.acquire()
+	try:
+		if not hasattr(bld, 'lines_cache'):
+			cache = None
+			if use_lines_cache and not use_trigraphs and getattr(bld, 'variant_dir', None):
+				cache = lines_cache(os.path.join(bld.variant_dir, Context.DBFILE + LINES_CACHE_SUFFIX))
+				bld.add_post_fun(lambda bld: cache.store())
+			bld.lines_cache = cache
+		return bld.lines_cache
+	finally:
+		lock.release()
+
 prec = {}
 """
 Operator precendence rules required for parsing expressions of the form::
@@ -395,6 +636,9 @@ def paste_tokens(t1, t2):
 		raise PreprocError('tokens do not make a valid paste %r and %r' % (t1, t2))
 	return (p1, t1[1] + t2[1])
 
+macro_cache = {}
+"""Macro definitions processed by :py:func:`waflib.Tools.c_preproc.extract_macro`, keyed by definition line"""
+
 def reduce_tokens(lst, defs, ban=[]):
 	"""
 	Replace the tokens in lst, using the macros provided in defs, and a list of macros that cannot be re-applied
@@ -435,10 +679,14 @@ def reduce_tokens(lst, defs, ban=[]):
 
 		elif p == IDENT and v in defs:
 
-			if isinstance(defs[v], str):
-				a, b = extract_macro(defs[v])
-				defs[v] = b
 			macro_def = defs[v]
+			if isinstance(macro_def, str):
+				# the definitions are not replaced in defs, see waflib.Tools.c_preproc.include_frame
+				try:
+					macro_def = macro_cache[macro_def]
+				except KeyError:
+					a, b = extract_macro(macro_def)
+					macro_cache[macro_def] = macro_def = b
 			to_add = macro_def[1]
 
 			if isinstance(macro_def[0], list):
@@ -769,6 +1017,83 @@ def define_name(line):
 	"""
 	return re_mac.match(line).group(0)
 
+class macro_table(dict):
+	"""
+	Macro definitions of a :py:class:`waflib.Tools.c_preproc.c_parser`. The macros read and modified
+	while a header is processed are recorded in the :py:class:`waflib.Tools.c_preproc.include_frame` objects active.
+	"""
+	__slots__ = ('frames',)
+
+	def __init__(self, *k):
+		dict.__init__(self, *k)
+		self.frames = []
+		"""Headers being processed, the innermost one last"""
+
+	def read(self, key):
+		"Record the value of a macro (None if not defined) in the frames that did not read or modify it before"
+		val = dict.get(self, key)
+		for frame in reversed(self.frames):
+			if key in frame.reads or key in frame.writes:
+				# the outer frames have it too
+				break
+			frame.reads[key] = val
+
+	def __contains__(self, key):
+		if self.frames:
+			self.read(key)
+		return dict.__contains__(self, key)
+
+	def __getitem__(self, key):
+		if self.frames:
+			self.read(key)
+		return dict.__getitem__(self, key)
+
+	def get(self, key, default=None):
+		if self.frames:
+			self.read(key)
+		return dict.get(self, key, default)
+
+	def __setitem__(self, key, val):
+		for frame in self.frames:
+			frame.writes[key] = val
+		dict.__setitem__(self, key, val)
+
+	def __delitem__(self, key):
+		for frame in self.frames:
+			frame.writes[key] = None
+		dict.__delitem__(self, key)
+
+	def remove(self, key):
+		"Undefine a macro if it is defined"
+		for frame in self.frames:
+			frame.writes[key] = None
+		dict.pop(self, key, None)
+
+class include_frame(object):
+	"""
+	Effects of a header processed by :py:class:`waflib.Tools.c_preproc.c_parser`, including the headers it includes:
+	the macros and the banned includes (#pragma once, #import) read and modified, and the headers found.
+	When the header is included again with the same values for what it read, the results are reused
+	instead of processing the header again, see :py:meth:`waflib.Tools.c_preproc.c_parser.include`.
+	"""
+	__slots__ = ('node', 'depth', 'state', 'start', 'valid', 'reads', 'writes', 'bans', 'banned', 'names')
+
+	def __init__(self, node, depth, state, start):
+		self.node = node
+		self.depth = depth
+		"""Size of the stack of folders while the header is processed"""
+		self.state = state
+		"""Size of the stack of #if states, it must not change"""
+		self.start = start
+		"""Position of the header in the list of nodes found"""
+		self.valid = True
+		"""Set to False if the header could not be processed completely"""
+		self.reads = {}
+		self.writes = {}
+		self.bans = {}
+		self.banned = set()
+		self.names = []
+
 class c_parser(object):
 	"""
 	Used by :py:func:`waflib.Tools.c_preproc.scan` to parse c/h files. Note that by default,
@@ -779,9 +1104,9 @@ class c_parser(object):
 		"""list of lines read"""
 
 		if defines is None:
-			self.defs  = {}
+			self.defs  = macro_table()
 		else:
-			self.defs  = dict(defines) # make a copy
+			self.defs  = macro_table(defines) # make a copy
 		self.state = []
 
 		self.count_files = 0
@@ -802,6 +1127,12 @@ class c_parser(object):
 		self.ban_includes = set([])
 		"""Includes that must not be read (#pragma once)"""
 
+		self.lines_cache = None
+		"""Persistent cache of the lines read, see :py:func:`waflib.Tools.c_preproc.get_lines_cache`"""
+
+		self.memo = None
+		"""Results of the headers processed, shared by the parsers having the same include paths, see :py:meth:`waflib.Tools.c_preproc.c_parser.include`"""
+
 	def cached_find_resource(self, node, filename):
 		"""
 		Find a file from the input directory
@@ -822,6 +1153,11 @@ class c_parser(object):
 		try:
 			return nd[tup]
 		except KeyError:
+			pass
+
+		# the node tree may be modified, and the scanners may run in threads (waflib.Runner.Parallel.scan_tasks)
+		lock.acquire()
+		try:
 			ret = node.find_resource(filename)
 			if ret:
 				if getattr(ret, 'children', None):
@@ -832,6 +1168,8 @@ class c_parser(object):
 						ret = None
 			nd[tup] = ret
 			return ret
+		finally:
+			lock.release()
 
 	def tryfind(self, filename):
 		"""
@@ -855,16 +1193,134 @@ class c_parser(object):
 				break
 			found = self.cached_find_resource(n, filename)
 
-		if found and not found in self.ban_includes:
+		if found and not self.is_banned(found):
 			# TODO the duplicates do not increase the no-op build times too much, but they may be worth removing
 			self.nodes.append(found)
 			if filename[-4:] != '.moc':
-				self.addlines(found)
+				if self.memo is None:
+					self.addlines(found)
+				else:
+					# processed after current_file is set, like the lines added by addlines
+					self.lines.append((MEMOFILE, found))
 		else:
-			if not filename in self.names:
-				self.names.append(filename)
+			self.add_name(filename)
 		return found
 
+	def is_banned(self, node):
+		"""
+		:param node: header found
+		:type node: :py:class:`waflib.Node.Node`
+		:return: True if the header must not be read again (#pragma once, #import)
+		:rtype: bool
+		"""
+		ret = node in self.ban_includes
+		for frame in reversed(self.defs.frames):
+			if node in frame.bans or node in frame.banned:
+				break
+			frame.bans[node] = ret
+		return ret
+
+	def ban(self, node):
+		"""
+		Add a node to :py:attr:`waflib.Tools.c_preproc.c_parser.ban_includes`
+
+		:param node: header
+		:type node: :py:class:`waflib.Node.Node`
+		"""
+		for frame in self.defs.frames:
+			frame.banned.add(node)
+		self.ban_includes.add(node)
+
+	def include(self, node):
+		"""
+		Process a header found by :py:meth:`waflib.Tools.c_preproc.c_parser.tryfind`: reuse the results of
+		a previous inclusion if the macros and the banned includes it read have the same values,
+		or add its lines and record its effects in a new :py:class:`waflib.Tools.c_preproc.include_frame`
+
+		:param node: header
+		:type node: :py:class:`waflib.Node.Node`
+		"""
+		defs = self.defs
+		ban = self.ban_includes
+		get = dict.get
+		for entry in self.memo.get(node, ()):
+			for (key, val) in entry[0].items():
+				if get(defs, key) != val:
+					break
+			else:
+				for (key, val) in entry[1].items():
+					if (key in ban) != val:
+						break
+				else:
+					self.replay(entry)
+					return
+
+		frames = defs.frames
+		count = len(self.lines)
+		try:
+			self.addlines(node)
+		except Exception:
+			for frame in frames:
+				frame.valid = False
+			raise
+		if len(self.lines) > count:
+			frames.append(include_frame(node, len(self.currentnode_stack), len(self.state), len(self.nodes)))
+		else:
+			for frame in frames:
+				frame.valid = False
+
+	def end_frame(self):
+		"Store the effects of the header processed in :py:attr:`waflib.Tools.c_preproc.c_parser.memo`"
+		frames = self.defs.frames
+		frame = frames.pop()
+		if frame.valid and frame.state == len(self.state):
+			entry = (frame.reads, frame.bans, frame.writes, frame.banned, self.nodes[frame.start:], frame.names, self.current_file)
+			lst = self.memo.setdefault(frame.node, [])
+			lst.append(entry)
+			if len(lst) > include_memo_size:
+				del lst[0]
+		else:
+			for frame in frames:
+				frame.valid = False
+
+	def replay(self, entry):
+		"""
+		Apply the effects of a header recorded by :py:meth:`waflib.Tools.c_preproc.c_parser.end_frame`
+
+		:param entry: macros and banned includes read and modified, headers found, missing headers and current file
+		:type entry: tuple
+		"""
+		(reads, bans, writes, banned, nodes, names, current_file) = entry
+		defs = self.defs
+		if defs.frames:
+			for key in reads:
+				defs.read(key)
+			for key in bans:
+				self.is_banned(key)
+		for (key, val) in writes.items():
+			if val is None:
+				defs.remove(key)
+			else:
+				defs[key] = val
+		for node in banned:
+			self.ban(node)
+		self.nodes.extend(nodes)
+		for name in names:
+			self.add_name(name)
+		self.current_file = current_file
+
+	def add_name(self, filename):
+		"""
+		Add a file name to :py:attr:`waflib.Tools.c_preproc.c_parser.names`
+
+		:param filename: header that could not be found
+		:type filename: string
+		"""
+		for frame in self.defs.frames:
+			frame.names.append(filename)
+		if not filename in self.names:
+			self.names.append(filename)
+
 	def addlines(self, node):
 		"""
 		Add the lines from a header in the list of preprocessor lines to parse
@@ -891,8 +1347,16 @@ class c_parser(object):
 			return
 
 		try:
-			lines = filter_comments(filepath)
-			lines.append((POPFILE, ''))
+			lc = self.lines_cache
+			if lc:
+				(sig, lines) = lc.get(filepath)
+				if lines is None:
+					lines = filter_comments(filepath)
+					lc.set(filepath, sig, lines)
+				lines = lines + [(POPFILE, '')]
+			else:
+				lines = filter_comments(filepath)
+				lines.append((POPFILE, ''))
 			lines.reverse()
 			pc[filepath] = lines # cache the lines filtered
 			self.lines.extend(lines)
@@ -922,6 +1386,14 @@ class c_parser(object):
 		except AttributeError:
 			bld.parse_cache = {}
 			self.parse_cache = bld.parse_cache
+		self.lines_cache = get_lines_cache(bld)
+
+		if use_include_memo and isinstance(self.defs, macro_table):
+			try:
+				memo = bld.include_memo
+			except AttributeError:
+				memo = bld.include_memo = {}
+			self.memo = memo.setdefault((self.__class__, tuple(self.nodepaths)), {})
 
 		self.current_file = node
 		self.addlines(node)
@@ -939,11 +1411,18 @@ class c_parser(object):
 		while self.lines:
 			(token, line) = self.lines.pop()
 			if token == POPFILE:
+				frames = self.defs.frames
+				if frames and frames[-1].depth == len(self.currentnode_stack):
+					self.end_frame()
 				self.count_files -= 1
 				self.currentnode_stack.pop()
 				continue
 
 			try:
+				if token == MEMOFILE:
+					self.include(line)
+					continue
+
 				ve = Logs.verbose
 				if ve: debug('preproc: line is %s - %s state is %s', token, line, self.state)
 				state = self.state
@@ -977,7 +1456,7 @@ class c_parser(object):
 					if kind == '"' or not strict_quotes:
 						self.current_file = self.tryfind(inc)
 						if token == 'import':
-							self.ban_includes.add(self.current_file)
+							self.ban(self.current_file)
 				elif token == 'elif':
 					if state[-1] == accepted:
 						state[-1] = skipped
@@ -999,7 +1478,7 @@ class c_parser(object):
 						#print "undef %s" % name
 				elif token == 'pragma':
 					if re_pragma_once.match(line.lower()):
-						self.ban_includes.add(self.current_file)
+						self.ban(self.current_file)
 			except Exception as e:
 				if Logs.verbose:
 					debug('preproc: line parsing failed (%s): %s %s', e, line, Utils.ex_stack())
@@ -1021,7 +1500,11 @@ def scan(task):
 		raise Errors.WafError('%r is missing a feature such as "c", "cxx" or "includes": ' % task.generator)
 
 	if go_absolute:
-		nodepaths = incn + [task.generator.bld.root.find_dir(x) for x in standard_includes]
+		lock.acquire()
+		try:
+			nodepaths = incn + [task.generator.bld.root.find_dir(x) for x in standard_includes]
+		finally:
+			lock.release()
 	else:
 		nodepaths = [x for x in incn if x.is_child_of(x.ctx.srcnode) or x.is_child_of(x.ctx.bldnode)]
 
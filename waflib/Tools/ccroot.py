@@ -7,8 +7,8 @@ Classes and methods shared by tools providing support for C-like language such
 as C/C++/D/Assembly/Go (this support module is almost never used alone).
 """
 
-import os, re
-from waflib import Task, Utils, Node, Errors
+import os, re, time
+from waflib import Task, Utils, Node, Errors, Logs, Options
 from waflib.TaskGen import after_method, before_method, feature, taskgen_method, extension
 from waflib.Tools import c_aliases, c_preproc, c_config, c_osx, c_tests
 from waflib.Configure import conf
@@ -35,6 +35,15 @@ USELIB_VARS['dstlib']   = set(['ARFLAGS', 'LINKDEPS'])
 
 USELIB_VARS['asm'] = set(['ASFLAGS'])
 
+UNITY_SIZE = 20
+"""Default amount of files per batch when the attribute *unity* is set to True, see :py:func:`waflib.Tools.ccroot.apply_unity`"""
+
+UNITY_RECENT = 3600
+"""Files modified during the last seconds are compiled separately if they were modified since the compilation of their batch"""
+
+UNITY_IMBALANCE = 2.0
+"""The batches are computed again when this divides the estimated compilation time of the longest batch by this factor"""
+
 # =================================================================================================
 
 @taskgen_method
@@ -121,6 +130,192 @@ def apply_incpaths(self):
 	self.includes_nodes = lst
 	self.env['INCPATHS'] = [x.abspath() for x in lst]
 
+def parse_deps(txt):
+	"""
+	Return the file names listed as prerequisites in the makefile rules written by ``gcc -MMD``.
+	The rules may be given either as a single rule with continued lines or as one rule per dependency;
+	the spaces in file names are escaped by backslashes.
+
+	:param txt: contents of a *.d* file
+	:type txt: string
+	:rtype: list of string
+	"""
+	txt = txt.replace('\\\r\n', ' ').replace('\\\n', ' ')
+	seen = set()
+	lst = []
+	for line in txt.splitlines():
+		# search for ': ' as a plain colon may be part of a windows path
+		idx = line.find(': ')
+		if idx >= 0:
+			line = line[idx + 2:]
+		elif line.rstrip().endswith(':'):
+			continue
+		for x in line.replace('\\ ', '\0').split():
+			x = x.replace('\0', ' ').replace('$$', '$')
+			if not x in seen:
+				seen.add(x)
+				lst.append(x)
+	return lst
+
+class compile_task(Task.Task):
+	"""
+	Base class for the c/c++ compilation tasks. When the compiler is able to write the dependencies
+	(``env[deps_var]``, for example *-MMD* for gcc), the file written next to the object file is read after
+	each compilation and replaces the dependencies found by :py:mod:`waflib.Tools.c_preproc`.
+	The python preprocessor is then only used for the first build, or when tasks of the current
+	build group may create headers that the previous compilation could not know about.
+	"""
+	scan_in_threads = True
+
+	deps_var = None
+	"""Name of the variable containing the flags for writing the dependency files, or None to use the python preprocessor only"""
+
+	pch_task = None
+	"""Name of the task class compiling the precompiled headers for this type of task, see :py:func:`waflib.Tools.ccroot.apply_pch`"""
+
+	flags_var = None
+	"""Name of the variable containing the compilation flags, such as *CFLAGS*"""
+
+	unity_ext = None
+	"""Extension of the files created for compiling several files at once, or None if not supported, see :py:func:`waflib.Tools.ccroot.apply_unity`"""
+
+	def scan(self):
+		"""
+		Return the dependencies written by the compiler during the previous build, or
+		call :py:func:`waflib.Tools.c_preproc.scan` if they are missing or possibly incomplete
+		"""
+		bld = self.generator.bld
+		if self.deps_var and self.env[self.deps_var] and not self.has_pending_outputs():
+			try:
+				return (bld.node_deps[self.uid()], [])
+			except KeyError:
+				pass
+		self.preproc_scanned = True
+		return c_preproc.scan(self)
+
+	def has_pending_outputs(self):
+		"""
+		Tell if the current build group contains tasks which have not been executed yet
+		and which are not compilation tasks; their outputs may be headers
+		"""
+		bld = self.generator.bld
+		try:
+			cache = bld.dct_pending_outputs
+		except AttributeError:
+			bld.dct_pending_outputs = cache = {}
+
+		try:
+			lst = cache[bld.cur]
+		except KeyError:
+			lst = cache[bld.cur] = [tsk for tsk in bld.cur_tasks if tsk.outputs and not isinstance(tsk, (compile_task, link_task, unity_file))]
+
+		for tsk in lst:
+			if not tsk.hasrun:
+				return True
+		return False
+
+	def post_run(self):
+		"""
+		Read the dependency file written by the compiler, and store the dependencies in
+		:py:attr:`waflib.Build.BuildContext.node_deps` before updating the task signature
+		"""
+		if getattr(self, 'batch', None):
+			self.post_batch()
+
+		if not self.deps_var or not self.env[self.deps_var] or getattr(self, 'cached', None):
+			return Task.Task.post_run(self)
+
+		bld = self.generator.bld
+		name = os.path.splitext(self.outputs[0].abspath())[0] + '.d'
+		try:
+			lst = parse_deps(Utils.readf(name))
+		except (OSError, IOError):
+			Logs.debug('deps: could not read %r, keeping the dependencies of %r' % (name, self))
+			return Task.Task.post_run(self)
+
+		try:
+			cache = bld.cache_deps_nodes
+		except AttributeError:
+			cache = bld.cache_deps_nodes = {}
+
+		nodes = []
+		c_preproc.lock.acquire()
+		try:
+			for x in lst:
+				try:
+					node = cache[x]
+				except KeyError:
+					if os.path.isabs(x):
+						node = bld.root.find_resource(x)
+					else:
+						# relative to the folder in which the compiler was executed
+						path = bld.bldnode
+						k = [y for y in Utils.split_path(x) if y and y != '.']
+						while k and k[0] == '..':
+							k = k[1:]
+							path = path.parent
+						node = k and path.find_resource(k) or None
+					cache[x] = node
+
+				if not node:
+					Logs.debug('deps: could not find %r for %r, keeping the dependencies' % (x, self))
+					return Task.Task.post_run(self)
+				if node is self.inputs[0]:
+					continue
+				if not c_preproc.go_absolute and not (node.is_child_of(bld.srcnode) or node.is_child_of(bld.bldnode)):
+					continue
+				nodes.append(node)
+		finally:
+			c_preproc.lock.release()
+
+		Logs.debug('deps: compiler returned %s for %s' % (str(nodes), str(self)))
+
+		if getattr(self, 'preproc_scanned', None) and getattr(self, 'cache_sig', None):
+			# the other builds from scratch will look for the files in the cache (WAFCACHE)
+			# from the dependencies found by the preprocessor, see Task.put_files_cache
+			self.cache_aliases = [self.cache_sig]
+
+		# compute the signature again, the new dependencies are stored by sig_implicit_deps
+		try:
+			del bld.task_sigs[(self.uid(), 'imp')]
+		except KeyError:
+			pass
+		self.scan_result = (nodes, [])
+		try:
+			del self.cache_sig
+		except AttributeError:
+			pass
+		Task.Task.post_run(self)
+
+	def post_batch(self):
+		"""
+		Record the signatures of the files compiled in a unity batch, and split the duration of the task
+		among them to estimate their compilation times, see :py:func:`waflib.Tools.ccroot.apply_unity`
+		"""
+		bld = self.generator.bld
+		durations = bld.task_durations
+		total = sum(x[2] for x in self.batch)
+		for (uid, node, cost) in self.batch:
+			bld.task_sigs[(uid, 'unity')] = node.get_bld_sig()
+			if not getattr(self, 'cached', None):
+				if total > 0:
+					val = self.duration * cost / total
+				else:
+					val = self.duration / len(self.batch)
+				# average with the previous value, the durations vary with the load of the machine
+				key = (uid, 'unity')
+				durations[key] = (durations.get(key, val) + val) / 2.0
+
+class unity_file(Task.Task):
+	"""
+	Write a source file including the files to compile in a unity batch, see :py:func:`waflib.Tools.ccroot.apply_unity`
+	"""
+	color = 'CYAN'
+	def run(self):
+		node = self.outputs[0]
+		lst = ['#include "%s"\n' % x.path_from(node.parent).replace('\\', '/') for x in self.inputs]
+		node.write(''.join(lst))
+
 class link_task(Task.Task):
 	"""
 	Base class for all link tasks. A task generator is supposed to have at most one link task bound in the attribute *link_task*. See :py:func:`waflib.Tools.ccroot.apply_link`.
@@ -418,6 +613,221 @@ def propagate_uselib_vars(self):
 		for v in _vars:
 			env.append_value(v, env[v + '_' + x])
 
+@feature('c', 'cxx', 'pch')
+@after_method('apply_link', 'apply_incpaths')
+def apply_pch(self):
+	"""
+	Compile the header given in the attribute *pch* into a precompiled header, and make the compilation
+	tasks of the task generator use it::
+
+		def build(bld):
+			bld.program(source='main.cpp', target='app', includes='.', pch='stdafx.h')
+
+	The sources should include the header first. A precompiled header task is created for each type of
+	compilation task (see :py:attr:`waflib.Tools.ccroot.compile_task.pch_task`); it is shared by the
+	task generators of the same build group compiling the same header with the same flags.
+	Nothing is done if the compiler does not support precompiled headers (``env.PCH_EXT`` is empty),
+	so the header is then simply included by the sources.
+	"""
+	pch = getattr(self, 'pch', None)
+	if not pch or not self.env.PCH_EXT or not getattr(self, 'compiled_tasks', None):
+		return
+
+	node = pch
+	if not isinstance(node, Node.Node):
+		node = self.path.find_resource(pch)
+		if not node:
+			raise Errors.WafError('could not find the precompiled header %r in %r' % (pch, self))
+
+	try:
+		cache = self.bld.pch_tasks
+	except AttributeError:
+		cache = self.bld.pch_tasks = {}
+
+	tasks = {}
+	for tsk in self.compiled_tasks:
+		name = getattr(tsk, 'pch_task', None)
+		if not name:
+			continue
+		try:
+			gch = tasks[name]
+		except KeyError:
+			cls = Task.classes[name]
+			sig = Utils.h_list([self.env[x] for x in cls.vars])
+			key = (name, node, self.bld.get_group_idx(self), sig)
+			try:
+				gch = cache[key]
+			except KeyError:
+				out = node.parent.find_or_declare('%s.%s%s' % (node.name, Utils.to_hex(sig)[:8], self.env.PCH_EXT))
+				gch = cache[key] = self.create_task(name, node, out)
+				# the flags added below must not be used for compiling the header
+				gch.env = self.env.derive()
+				gch.env.detach()
+			tasks[name] = gch
+		tsk.set_run_after(gch)
+		tsk.dep_nodes.append(gch.outputs[0])
+
+	for gch in tasks.values():
+		# gcc looks for the file name given to -include with the .gch extension first
+		path = gch.outputs[0].abspath()[:-len(self.env.PCH_EXT)]
+		self.env.append_value(gch.flags_var, self.env.PCH_INCLUDE_F + [path])
+
+@feature('c', 'cxx')
+@after_method('process_source')
+@before_method('apply_link')
+def apply_unity(self):
+	"""
+	Compile the c/c++ files of the task generator by batches (unity builds)::
+
+		def build(bld):
+			bld.program(source=bld.path.ant_glob('*.cpp'), target='app', unity=True)
+
+	The attribute *unity* may be True or the amount of files per batch (:py:const:`waflib.Tools.ccroot.UNITY_SIZE` by default);
+	the option ``--unity`` sets it for all task generators. The batches are balanced using the compilation times of the
+	previous builds (or the file sizes), and they are kept between the builds so that the object files remain valid.
+	A file modified since the compilation of its batch is compiled separately while it is being edited
+	(:py:const:`waflib.Tools.ccroot.UNITY_RECENT`), so that the whole batch is not compiled again after each change.
+	"""
+	size = getattr(self, 'unity', None)
+	if size is None:
+		size = getattr(Options.options, 'unity', 0)
+	if size is True:
+		size = UNITY_SIZE
+	if not size or size < 2 or not getattr(self, 'compiled_tasks', None):
+		return
+
+	bld = self.bld
+	names = []
+	tasks = {}
+	for tsk in self.compiled_tasks:
+		if not getattr(tsk, 'unity_ext', None) or len(tsk.inputs) != 1:
+			continue
+		node = tsk.inputs[0]
+		# the files created during the build are not batched
+		if node.is_bld() and bld.bldnode is not bld.srcnode:
+			continue
+		name = tsk.__class__.__name__
+		if not name in tasks:
+			names.append(name)
+			tasks[name] = []
+		tasks[name].append(tsk)
+
+	for name in names:
+		if len(tasks[name]) > 1:
+			self.make_unity_batches(tasks[name], size)
+
+def unity_batches(uids, cost, size):
+	"""
+	Distribute files into batches of about *size* files having similar compilation times, by adding the longest
+	files first to the batch having the lowest total (longest processing time first)
+
+	:param uids: identifiers of the files
+	:type uids: list
+	:param cost: estimated compilation time for each identifier
+	:type cost: dict
+	:param size: average amount of files per batch
+	:type size: int
+	:return: list of lists of identifiers, in the order of *uids* in each batch
+	:rtype: list
+	"""
+	pos = dict((k, i) for (i, k) in enumerate(uids))
+	count = (len(uids) + size - 1) // size
+	batches = [[] for i in range(count)]
+	totals = [0.0] * count
+	for k in sorted(uids, key=lambda x: (-cost[x], pos[x])):
+		i = min(range(count), key=lambda i: (totals[i], len(batches[i]), i))
+		batches[i].append(k)
+		totals[i] += cost[k]
+	for x in batches:
+		x.sort(key=lambda k: pos[k])
+	return batches
+
+@taskgen_method
+def make_unity_batches(self, lst, size):
+	"""
+	Replace compilation tasks of the same type by tasks compiling batches of files, see :py:func:`waflib.Tools.ccroot.apply_unity`.
+	The batches are stored in :py:attr:`waflib.Build.BuildContext.task_sigs` with the key ``(key, 'unity')``, and the signatures
+	and the estimated compilation times of the files compiled in a batch in task_sigs and task_durations with the keys ``(uid, 'unity')``,
+	where uid is the identifier of the task compiling the file alone.
+
+	:param lst: compilation tasks of the same class
+	:type lst: list of :py:class:`waflib.Tools.ccroot.compile_task`
+	:param size: average amount of files per batch
+	:type size: int
+	"""
+	bld = self.bld
+	durations = bld.task_durations
+	name = lst[0].__class__.__name__
+	uids = [tsk.uid() for tsk in lst]
+	tasks = dict(zip(uids, lst))
+
+	# estimated compilation times: shares of the durations of the previous batches, else the file sizes scaled by the known shares
+	# (the durations of the files compiled separately also include the processing of the headers)
+	sizes = {}
+	for (k, tsk) in tasks.items():
+		try:
+			sizes[k] = os.stat(tsk.inputs[0].abspath()).st_size
+		except OSError:
+			sizes[k] = 0
+	known = [k for k in uids if (k, 'unity') in durations]
+	scale = 1.0
+	if known:
+		scale = sum(durations[(k, 'unity')] for k in known) / max(1, sum(sizes[k] for k in known))
+	cost = dict((k, durations.get((k, 'unity'), sizes[k] * scale)) for k in uids)
+	def longest(batches):
+		return max(sum(cost[k] for k in x) for x in batches)
+
+	key = Utils.h_list([self.path.abspath(), self.get_name(), name, size])
+	batches = unity_batches(uids, cost, size)
+	prev = bld.task_sigs.get((key, 'unity'))
+	if prev:
+		# keep the previous batches, adding the new files to the shortest batches having less than size files
+		prev = [[k for k in x if k in tasks] for x in prev]
+		prev = [x for x in prev if x]
+		known = set(k for x in prev for k in x)
+		for k in uids:
+			if not k in known:
+				free = [x for x in prev if len(x) < size]
+				if free:
+					min(free, key=lambda x: sum(cost[y] for y in x)).append(k)
+				else:
+					prev.append([k])
+		if longest(batches) * UNITY_IMBALANCE > longest(prev):
+			batches = prev
+	bld.task_sigs[(key, 'unity')] = batches
+
+	now = time.time()
+	def modified(k):
+		node = tasks[k].inputs[0]
+		try:
+			if now - os.stat(node.abspath()).st_mtime > UNITY_RECENT:
+				return False
+		except OSError:
+			return False
+		try:
+			return bld.task_sigs[(k, 'unity')] != node.get_bld_sig()
+		except KeyError:
+			# compiled separately during the previous build
+			return k in bld.task_sigs
+
+	removed = set()
+	for (i, x) in enumerate(batches):
+		batch = [k for k in x if not modified(k)]
+		if len(batch) < 2:
+			continue
+		inputs = [tasks[k].inputs[0] for k in batch]
+		node = self.path.find_or_declare('unity.%d.%d%s' % (self.idx, i, tasks[batch[0]].unity_ext))
+		self.create_task('unity_file', inputs, node)
+		tsk = self.create_compiled_task(name, node)
+		tsk.batch = [(k, tasks[k].inputs[0], cost[k]) for k in batch]
+		# the entries of the files and of the batches must not be removed from the build data
+		tsk.batch_uids = [key] + batch
+		removed.update(tasks[k] for k in batch)
+
+	if removed:
+		self.tasks = [x for x in self.tasks if not x in removed]
+		self.compiled_tasks = [x for x in self.compiled_tasks if not x in removed]
+
 # ============ the code above must not know anything about import libs ==========
 
 @feature('cshlib', 'cxxshlib', 'fcshlib')
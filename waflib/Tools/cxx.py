@@ -6,7 +6,7 @@
 
 from waflib import TaskGen, Task, Utils
 from waflib.Tools import c_preproc
-from waflib.Tools.ccroot import link_task, stlink_task
+from waflib.Tools.ccroot import link_task, stlink_task, compile_task
 
 @TaskGen.extension('.cpp','.cc','.cxx','.C','.c++')
 def cxx_hook(self, node):
@@ -16,12 +16,23 @@ def cxx_hook(self, node):
 if not '.c' in TaskGen.task_gen.mappings:
 	TaskGen.task_gen.mappings['.c'] = TaskGen.task_gen.mappings['.cpp']
 
-class cxx(Task.Task):
+class cxx(compile_task):
 	"Compile C++ files into object files"
-	run_str = '${CXX} ${ARCH_ST:ARCH} ${CXXFLAGS} ${CPPFLAGS} ${FRAMEWORKPATH_ST:FRAMEWORKPATH} ${CPPPATH_ST:INCPATHS} ${DEFINES_ST:DEFINES} ${CXX_SRC_F}${SRC} ${CXX_TGT_F}${TGT}'
+	run_str = '${CXX} ${ARCH_ST:ARCH} ${CXXFLAGS} ${CPPFLAGS} ${FRAMEWORKPATH_ST:FRAMEWORKPATH} ${CPPPATH_ST:INCPATHS} ${DEFINES_ST:DEFINES} ${CXX_DEPS_F} ${CXX_SRC_F}${SRC} ${CXX_TGT_F}${TGT}'
 	vars    = ['CXXDEPS'] # unused variable to depend on, just in case
 	ext_in  = ['.h'] # set the build order easily by using ext_out=['.h']
-	scan    = c_preproc.scan
+	deps_var = 'CXX_DEPS_F'
+	pch_task = 'cxx_pch'
+	flags_var = 'CXXFLAGS'
+	unity_ext = '.cpp'
+
+class cxx_pch(compile_task):
+	"Compile a header into a precompiled header, see :py:func:`waflib.Tools.ccroot.apply_pch`"
+	run_str = '${CXX} ${ARCH_ST:ARCH} ${CXXFLAGS} ${CPPFLAGS} ${FRAMEWORKPATH_ST:FRAMEWORKPATH} ${CPPPATH_ST:INCPATHS} ${DEFINES_ST:DEFINES} ${CXX_DEPS_F} ${CXXPCH_F} ${CXX_SRC_F}${SRC} ${CXX_TGT_F}${TGT}'
+	ext_in  = ['.h']
+	color   = 'BLUE'
+	deps_var = 'CXX_DEPS_F'
+	flags_var = 'CXXFLAGS'
 
 class cxxprogram(link_task):
 	"Link object files into a c++ program"
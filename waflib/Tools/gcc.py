@@ -31,6 +31,12 @@ def gcc_common_flags(conf):
 
 	v['CC_SRC_F']            = []
 	v['CC_TGT_F']            = ['-c', '-o']
+	v['CC_DEPS_F']           = ['-MMD'] # write the dependencies in a .d file, see waflib.Tools.ccroot.compile_task
+
+	# precompiled headers, see waflib.Tools.ccroot.apply_pch
+	v['CCPCH_F']             = ['-x', 'c-header']
+	v['PCH_INCLUDE_F']       = ['-include']
+	v['PCH_EXT']             = '.gch'
 
 	# linker
 	if not v['LINK_CC']: v['LINK_CC'] = v['CC']
@@ -31,6 +31,12 @@ def gxx_common_flags(conf):
 
 	v['CXX_SRC_F']           = []
 	v['CXX_TGT_F']           = ['-c', '-o']
+	v['CXX_DEPS_F']          = ['-MMD'] # write the dependencies in a .d file, see waflib.Tools.ccroot.compile_task
+
+	# precompiled headers, see waflib.Tools.ccroot.apply_pch
+	v['CXXPCH_F']            = ['-x', 'c++-header']
+	v['PCH_INCLUDE_F']       = ['-include']
+	v['PCH_EXT']             = '.gch'
 
 	# linker
 	if not v['LINK_CXX']: v['LINK_CXX'] = v['CXX']
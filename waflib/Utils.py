@@ -43,6 +43,25 @@ except ImportError:
 		# never fail to enable fixes from another module
 		pass
 
+try:
+	md5_orig = md5
+	"""Default hash function, see :py:func:`waflib.Utils.set_hash`"""
+except NameError:
+	pass
+
+hash_name = 'md5'
+"""Name of the hash function used for the signatures, see :py:func:`waflib.Utils.set_hash`"""
+
+try:
+	import mmap
+except ImportError:
+	mmap = None
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
 try:
 	import threading
 except ImportError:
@@ -176,6 +195,54 @@ def writef(fname, data, m='w', encoding='ISO8859-1'):
 	finally:
 		f.close()
 
+FICLONE = 0x40049409
+"""Linux ioctl for sharing the data of two files (reflink) on the file systems supporting it (btrfs, xfs)"""
+
+def copy_file(src, dst):
+	"""
+	Copy a file and its permissions and timestamps, like shutil.copy2. The data is shared if the file system
+	supports reflinks, else it is copied by the kernel (os.copy_file_range, python >= 3.8) when possible.
+
+	:param src: path of the file to copy
+	:type src: string
+	:param dst: path of the copy, which is replaced if it exists
+	:type dst: string
+	"""
+	fsrc = open(src, 'rb')
+	try:
+		fdst = open(dst, 'wb')
+		try:
+			fin = fsrc.fileno()
+			fout = fdst.fileno()
+			done = False
+			if fcntl and sys.platform.startswith('linux'):
+				try:
+					fcntl.ioctl(fout, FICLONE, fin)
+				except (IOError, OSError):
+					pass
+				else:
+					done = True
+			if not done and hasattr(os, 'copy_file_range'):
+				try:
+					while os.copy_file_range(fin, fout, 1 << 30):
+						pass
+				except OSError:
+					os.lseek(fin, 0, 0)
+					os.lseek(fout, 0, 0)
+					os.ftruncate(fout, 0)
+				else:
+					done = True
+			if not done:
+				shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+		finally:
+			fdst.close()
+	finally:
+		fsrc.close()
+	shutil.copystat(src, dst)
+
+MMAP_SIZE = 1024 * 1024
+"""Files larger than this size (in bytes) are mapped in memory by :py:func:`waflib.Utils.h_file` instead of being read in chunks"""
+
 def h_file(fname):
 	"""
 	Compute a hash value for a file by using md5. This method may be replaced by
@@ -200,9 +267,17 @@ def h_file(fname):
 	f = open(fname, 'rb')
 	m = md5()
 	try:
-		while fname:
-			fname = f.read(200000)
-			m.update(fname)
+		if mmap and os.fstat(f.fileno()).st_size > MMAP_SIZE:
+			# hash the whole file at once, the global interpreter lock is released meanwhile
+			mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			try:
+				m.update(mm)
+			finally:
+				mm.close()
+		else:
+			while fname:
+				fname = f.read(200000)
+				m.update(fname)
 	finally:
 		f.close()
 	return m.digest()
@@ -476,6 +551,42 @@ def quote_define_name(s):
 	fu = fu.upper()
 	return fu
 
+def set_hash(name):
+	"""
+	Select the hash function used for the file hashes and the task signatures, which replaces :py:func:`waflib.Utils.md5`.
+	The function is chosen during the configuration (``waf configure --hash=blake2b``):
+
+	* md5: default
+	* blake2b: from hashlib (Python >= 3.6)
+	* xxhash: xxh3_128 from the ``xxhash`` python module, non-cryptographic but much faster
+
+	The digests are 16 bytes long in all cases, so the folder names in WAFCACHE keep the same length.
+
+	:param name: hash function name
+	:type name: string
+	:raises: :py:class:`waflib.Errors.WafError` if the hash function is unknown or not available
+	"""
+	global md5, hash_name
+	if name == 'md5':
+		fun = md5_orig
+	elif name == 'blake2b':
+		try:
+			from hashlib import blake2b
+		except ImportError:
+			raise Errors.WafError('The hash function blake2b requires Python >= 3.6')
+		def fun(s=b''):
+			return blake2b(s, digest_size=16)
+	elif name == 'xxhash':
+		try:
+			import xxhash
+		except ImportError:
+			raise Errors.WafError('The hash function xxhash requires the python module xxhash')
+		fun = getattr(xxhash, 'xxh3_128', None) or xxhash.xxh128
+	else:
+		raise Errors.WafError('Unknown hash function %r (use md5, blake2b or xxhash)' % name)
+	md5 = fun
+	hash_name = name
+
 def h_list(lst):
 	"""
 	Hash lists. For tuples, using hash(tup) is much more efficient,
@@ -2,8 +2,14 @@
 # encoding: utf-8
 # Thomas Nagy 2011
 
-import os, shutil, re
-from waflib import Options, Build, Logs
+import os, shutil, re, time
+from waflib import Options, Build, Logs, Task, Utils, Context
+
+try:
+	from collections import OrderedDict
+except ImportError:
+	# python < 2.7
+	OrderedDict = None
 
 """
 Apply a least recently used policy to the Waf cache.
@@ -14,14 +20,43 @@ We assume that the the folders are written atomically
 
 Do export WAFCACHE=/tmp/foo_xyz where xyz represents the cache size in bytes
 If missing, the default cache size will be set to 10GB
+
+The cache folders are not listed after each build: the entries retrieved or added
+by the tasks are recorded, and written to a journal (lru.journal) at the end of the build.
+The total size of the cache is kept in the file lru.total. When it exceeds the cache size,
+the journal is merged into the index (lru.index, entries sorted by access time),
+and the oldest entries are removed. The files are modified by one process at a time (lru.lock).
+
+Reading and rewriting the index takes a time proportional to the amount of entries, but the
+total is then at most CLEANRATIO times the cache size, and the index is only read again once
+the entries added amount to (1 - CLEANRATIO) times the cache size (the total is over-estimated
+when entries are replaced, or when the shared files were stored by a previous build, and is
+then corrected). The cost is amortized over the entries added.
+
+The files shared by several entries (folder *objects*, see :py:func:`waflib.Task.cache_store`) are
+recorded with the entries and counted once. When no entry uses them anymore, they are removed, unless
+they are still linked in build directories: they are then kept in a list (lru.orphans), counted in the
+total, and removed by the next trimming operations once the build directories do not use them anymore.
+
+The index is created by listing the cache folders when it is missing. After a crash or
+after the cache is modified by other means, rebuild it with the command::
+
+	$ waf lru_rebuild
 """
 
 re_num = re.compile('[a-zA-Z_-]+(\d+)')
+re_entry = re.compile('^[0-9a-f]+$')
 
 CACHESIZE = 10*1024*1024*1024 # in bytes
 CLEANRATIO = 0.8
 DIRSIZE = 4096
 
+INDEX = 'lru.index'
+JOURNAL = 'lru.journal'
+TOTAL = 'lru.total'
+LOCK = 'lru.lock'
+ORPHANS = 'lru.orphans'
+
 def compile(self):
 	if Options.cache_global and not Options.options.nocache:
 		try:
@@ -29,70 +64,377 @@ def compile(self):
 		except:
 			pass
 
+	self.lru_records = []
 	try:
 		self.raw_compile()
 	finally:
 		if Options.cache_global and not Options.options.nocache:
 			self.sweep()
 
-def sweep(self):
+def get_cache_size():
 	global CACHESIZE
-	CACHEDIR = Options.cache_global
-
 	# get the cache max size from the WAFCACHE filename
-	re_num = re.compile('[a-zA-Z_]+(\d+)')
 	val = re_num.sub('\\1', os.path.basename(Options.cache_global))
 	try:
 		CACHESIZE = int(val)
 	except:
 		pass
+	return CACHESIZE
+
+def entry_size(d, shared=()):
+	"""
+	Size of a cache entry (folder *d*), each entry takes at least 4kB; the files
+	sharing their data with the files of the folder *objects* (inodes *shared*) are not counted
+	"""
+	cnt = DIRSIZE
+	for k in os.listdir(d):
+		st = os.stat(os.path.join(d, k))
+		if st.st_ino not in shared:
+			cnt += st.st_size
+	return cnt
+
+def object_path(cachedir, name):
+	"""
+	Return the path of the file *name* of the folder *objects* (:py:func:`waflib.Task.cache_store`)
+	"""
+	return os.path.join(cachedir, 'objects', name[:2], name)
+
+def record(self, d, size, objects=()):
+	"""
+	Record the use of the cache entry (folder *d*) of a task, size is -1 for an entry retrieved from the cache;
+	*objects* is a list of tuples (name, size) for the files of the folder *objects* used by a new entry
+	"""
+	try:
+		lst = self.generator.bld.lru_records
+	except AttributeError:
+		# not a build context with the method compile (multicheck)
+		return
+	lst.append(' '.join(['%s %d %r' % (os.path.basename(d), size, time.time())] + ['%s:%d' % x for x in objects]) + '\n')
+
+old_retrieve = Task.Task.can_retrieve_cache
+def can_retrieve_cache(self):
+	ret = old_retrieve(self)
+	if ret:
+		record(self, Utils.to_hex(self.uid()) + Utils.to_hex(self.signature()), -1)
+	return ret
+
+old_put = Task.Task.put_files_entry
+def put_files_entry(self, ssig, codec=None, level=None):
+	ret = old_put(self, ssig, codec, level)
+	if ret is not None:
+		d = os.path.join(self.generator.bld.cache_global, ssig)
+		try:
+			objects = [(os.path.basename(x), os.stat(x)) for x in ret]
+			size = entry_size(d, set([st.st_ino for (_, st) in objects]))
+		except OSError:
+			# another process removed it
+			pass
+		else:
+			record(self, d, size, [(k, st.st_size) for (k, st) in objects])
+	return ret
+
+class lock_cache(object):
+	"""
+	Lock held while the files of the index are read or written (fcntl locks, not available on win32)
+	"""
+	def __init__(self, cachedir):
+		self.fd = os.open(os.path.join(cachedir, LOCK), os.O_RDWR | os.O_CREAT, Utils.O644)
+		if Utils.fcntl:
+			Utils.fcntl.flock(self.fd, Utils.fcntl.LOCK_EX)
+	def release(self):
+		try:
+			if Utils.fcntl:
+				Utils.fcntl.flock(self.fd, Utils.fcntl.LOCK_UN)
+		finally:
+			os.close(self.fd)
+
+def read_total(cachedir):
+	try:
+		return int(Utils.readf(os.path.join(cachedir, TOTAL)))
+	except (IOError, OSError, ValueError):
+		return -1
+
+def write_atomic(path, data):
+	tmp = path + '.tmp'
+	Utils.writef(tmp, data)
+	try:
+		os.rename(tmp, path)
+	except OSError:
+		# win32
+		os.remove(path)
+		os.rename(tmp, path)
+
+def parse_objects(lst):
+	"Parse the files of the folder *objects* of a record (name:size) into a tuple of (name, size)"
+	ret = []
+	for x in lst:
+		(k, v) = x.rsplit(':', 1)
+		ret.append((k, int(v)))
+	return tuple(ret)
+
+def read_index(cachedir):
+	"""
+	Read the index and the journal, return an ordered dict mapping the entry names
+	to the tuples (size, access time, files of the folder *objects*), the least recently used first
+	"""
+	index = OrderedDict()
+	try:
+		txt = Utils.readf(os.path.join(cachedir, INDEX))
+	except (IOError, OSError):
+		txt = ''
+	for line in txt.splitlines():
+		lst = line.split()
+		index[lst[0]] = (int(lst[1]), float(lst[2]), parse_objects(lst[3:]))
+
+	try:
+		txt = Utils.readf(os.path.join(cachedir, JOURNAL))
+	except (IOError, OSError):
+		txt = ''
+	lst = []
+	for line in txt.splitlines():
+		try:
+			x = line.split()
+			lst.append((float(x[2]), x[0], int(x[1]), parse_objects(x[3:])))
+		except (ValueError, IndexError):
+			# incomplete write
+			pass
+	# several builds may have written to the journal
+	lst.sort()
+	for (t, k, s, objs) in lst:
+		v = index.pop(k, None)
+		if s < 0:
+			if not v:
+				continue
+			(s, objs) = (v[0], v[2])
+		index[k] = (s, t, objs)
+	return index
+
+def read_orphans(cachedir):
+	"""
+	Read the files of the folder *objects* used by no entry but still linked in build directories,
+	return a dict mapping the names to the sizes
+	"""
+	ret = {}
+	try:
+		txt = Utils.readf(os.path.join(cachedir, ORPHANS))
+	except (IOError, OSError):
+		txt = ''
+	for line in txt.splitlines():
+		try:
+			(k, v) = line.split()
+			ret[k] = int(v)
+		except ValueError:
+			pass
+	return ret
+
+def count_objects(index):
+	"""
+	Return a dict mapping the names of the files of the folder *objects* to the lists [amount of entries using the file, size]
+	"""
+	refs = {}
+	for (s, t, objs) in index.values():
+		for (k, v) in objs:
+			try:
+				refs[k][0] += 1
+			except KeyError:
+				refs[k] = [1, v]
+	return refs
+
+def write_index(cachedir, index, orphans):
+	"""
+	Write the index and the orphans, clear the journal and return the total size of the entries,
+	in which the files shared by several entries are counted once
+	"""
+	total = 0
+	buf = []
+	for (k, (s, t, objs)) in index.items():
+		total += s
+		buf.append(' '.join(['%s %d %r' % (k, s, t)] + ['%s:%d' % x for x in objs]) + '\n')
+	refs = count_objects(index)
+	for (k, v) in refs.items():
+		total += v[1]
+	lst = []
+	for (k, v) in orphans.items():
+		if not k in refs:
+			total += v
+			lst.append('%s %d\n' % (k, v))
+	write_atomic(os.path.join(cachedir, ORPHANS), ''.join(lst))
+	write_atomic(os.path.join(cachedir, INDEX), ''.join(buf))
+	write_atomic(os.path.join(cachedir, JOURNAL), '')
+	write_atomic(os.path.join(cachedir, TOTAL), str(total))
+	return total
+
+def remove_object(cachedir, name):
+	"""
+	Remove a file of the folder *objects* unless it is still linked in a build directory,
+	return True if the file does not exist anymore
+	"""
+	p = object_path(cachedir, name)
+	try:
+		if os.stat(p).st_nlink > 1:
+			return False
+		os.remove(p)
+	except OSError:
+		pass
+	return True
+
+def remove_entry(cachedir, k):
+	"""
+	Remove a cache entry, the files of the folder *objects* are removed by :py:func:`remove_object`
+	"""
+	p = os.path.join(cachedir, k)
+	v = p + '.del'
+	try:
+		os.rename(p, v)
+	except:
+		# someone already did it
+		return
+	try:
+		shutil.rmtree(v)
+	except:
+		# this should not happen, but who knows?
+		Logs.warn('If you ever see this message, report it (%r)' % v)
+
+def sweep(self):
+	CACHEDIR = Options.cache_global
+	if not OrderedDict:
+		Logs.warn('lru: the cache cannot be trimmed with this version of Python')
+		return
+	get_cache_size()
+
+	lock = lock_cache(CACHEDIR)
+	try:
+		total = read_total(CACHEDIR)
+		rebuilt = total < 0 or not os.path.exists(os.path.join(CACHEDIR, INDEX))
+		if rebuilt:
+			# the entries of this build are already counted
+			total = rebuild_index(CACHEDIR)
 
-	# map folder names to timestamps
-	flist = {}
-	for x in os.listdir(CACHEDIR):
-		j = os.path.join(CACHEDIR, x)
-		if os.path.isdir(j) and len(x) == 64: # dir names are md5 hexdigests
-			flist[x] = [os.stat(j).st_mtime, 0]
-
-	for (x, v) in flist.items():
-		cnt = DIRSIZE # each entry takes 4kB
-		d = os.path.join(CACHEDIR, x)
-		for k in os.listdir(d):
-			cnt += os.stat(os.path.join(d, k)).st_size
-		flist[x][1] = cnt
-
-	total = sum([x[1] for x in flist.values()])
-	Logs.debug('lru: Cache size is %r' % total)
-
-	if total >= CACHESIZE:
-		Logs.debug('lru: Trimming the cache since %r > %r' % (total, CACHESIZE))
-
-		# make a list to sort the folders by timestamp
-		lst = [(p, v[0], v[1]) for (p, v) in flist.items()]
-		lst.sort(key=lambda x: x[1]) # sort by timestamp
-		lst.reverse()
-
-		while total >= CACHESIZE * CLEANRATIO:
-			(k, t, s) = lst.pop()
-			p = os.path.join(CACHEDIR, k)
-			v = p + '.del'
+		if self.lru_records:
+			f = open(os.path.join(CACHEDIR, JOURNAL), 'a')
 			try:
-				os.rename(p, v)
-			except:
-				# someone already did it
-				pass
-			else:
-				try:
-					shutil.rmtree(v)
-				except:
-					# this should not happen, but who knows?
-					Logs.warn('If you ever see this message, report it (%r)' % v)
-			total -= s
-			del flist[k]
+				f.write(''.join(self.lru_records))
+			finally:
+				f.close()
+			seen = set()
+			for x in self.lru_records:
+				lst = x.split()
+				s = int(lst[1])
+				if s > 0 and not rebuilt:
+					# approximate, the entries replaced and the files of the folder objects
+					# stored by previous builds are counted twice
+					total += s
+					for (k, v) in parse_objects(lst[3:]):
+						if not k in seen:
+							seen.add(k)
+							total += v
+			write_atomic(os.path.join(CACHEDIR, TOTAL), str(total))
+			self.lru_records = []
+		Logs.debug('lru: Cache size is %r' % total)
+
+		if total >= CACHESIZE:
+			index = read_index(CACHEDIR)
+			orphans = read_orphans(CACHEDIR)
+			refs = count_objects(index)
+
+			# the orphans used again, or not linked in the build directories anymore
+			for k in list(orphans.keys()):
+				if k in refs or remove_object(CACHEDIR, k):
+					del orphans[k]
+
+			total = sum([x[0] for x in index.values()]) + sum([x[1] for x in refs.values()]) + sum(orphans.values())
+			Logs.debug('lru: Trimming the cache since %r > %r' % (total, CACHESIZE * CLEANRATIO))
+			# trim even if the total was over-estimated, so that the index is not read again in the next builds
+			# the least recently used entries come first
+			while total >= CACHESIZE * CLEANRATIO and index:
+				(k, (s, t, objs)) = index.popitem(last=False)
+				remove_entry(CACHEDIR, k)
+				total -= s
+				for (name, size) in objs:
+					v = refs[name]
+					v[0] -= 1
+					if v[0] == 0:
+						del refs[name]
+						if remove_object(CACHEDIR, name):
+							total -= size
+						else:
+							orphans[name] = size
+			total = write_index(CACHEDIR, index, orphans)
+	finally:
+		lock.release()
 
 	Logs.debug('lru: Total at the end %r' % total)
 
+def rebuild_index(cachedir):
+	"""
+	Create the index from the cache folders (the access times are the timestamps of the folders),
+	remove the files of the folder *objects* which are no longer used, and return the total size
+	"""
+	# the files stored by contents, the ones no longer used by the entries or by the build directories are removed
+	shared = {}
+	objects = os.path.join(cachedir, 'objects')
+	try:
+		folders = os.listdir(objects)
+	except OSError:
+		folders = []
+	for x in folders:
+		d = os.path.join(objects, x)
+		try:
+			files = os.listdir(d)
+		except OSError:
+			continue
+		for k in files:
+			p = os.path.join(d, k)
+			try:
+				st = os.stat(p)
+				if st.st_nlink == 1:
+					os.remove(p)
+				else:
+					shared[st.st_ino] = (k, st.st_size)
+			except OSError:
+				pass
+
+	lst = []
+	used = set()
+	for x in os.listdir(cachedir):
+		j = os.path.join(cachedir, x)
+		if re_entry.match(x) and os.path.isdir(j): # dir names are hexdigests
+			try:
+				objs = []
+				for k in os.listdir(j):
+					ino = os.stat(os.path.join(j, k)).st_ino
+					if ino in shared:
+						objs.append(shared[ino])
+						used.add(ino)
+				lst.append((os.stat(j).st_mtime, x, entry_size(j, shared), tuple(objs)))
+			except OSError:
+				pass
+	lst.sort()
+	index = OrderedDict()
+	for (t, k, s, objs) in lst:
+		index[k] = (s, t, objs)
+
+	# linked in build directories only
+	orphans = dict([v for (ino, v) in shared.items() if not ino in used])
+	return write_index(cachedir, index, orphans)
+
+class lru_rebuild(Context.Context):
+	'''rebuilds the index of the cache (WAFCACHE), for example after a crash'''
+	cmd = 'lru_rebuild'
+	def execute(self):
+		if not Options.cache_global:
+			self.fatal('WAFCACHE is not set')
+		if not OrderedDict:
+			self.fatal('This command requires Python 2.7')
+		lock = lock_cache(Options.cache_global)
+		try:
+			total = rebuild_index(Options.cache_global)
+		finally:
+			lock.release()
+		Logs.info('The cache contains %r bytes' % total)
+
 Build.BuildContext.raw_compile = Build.BuildContext.compile
 Build.BuildContext.compile = compile
 Build.BuildContext.sweep = sweep
-
+Task.Task.can_retrieve_cache = can_retrieve_cache
+Task.Task.put_files_entry = put_files_entry
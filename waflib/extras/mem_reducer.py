@@ -75,6 +75,7 @@ def get_out(self):
 	tsk = self.out.get()
 	if not self.stop:
 		self.add_more_tasks(tsk)
+	self.mark_finished(tsk)
 	self.count -= 1
 	self.dirty = True
 
@@ -93,6 +94,12 @@ def get_out(self):
 	return tsk
 Runner.Parallel.get_out = get_out
 
+def add_incomplete(self, tsk):
+	# the run_after sets are shared between tasks, expanding them into
+	# dependency counters would defeat the purpose of this tool
+	return 0
+Runner.Parallel.add_incomplete = add_incomplete
+
 if 1:
 	def start(self):
 		self.total = self.bld.total()
@@ -114,6 +121,7 @@ if 1:
 			if tsk.hasrun:
 				# if the task is marked as "run", just skip it
 				self.processed += 1
+				self.mark_finished(tsk)
 				continue
 
 			if self.stop: # stop immediately after a failure was detected
@@ -135,6 +143,7 @@ if 1:
 					else:
 						if Logs.verbose > 1:
 							self.error.append(tsk)
+					self.mark_finished(tsk)
 					continue
 				tsk.hasrun = Task.EXCEPTION
 				self.error_handler(tsk)
@@ -146,6 +155,7 @@ if 1:
 				self.processed += 1
 				tsk.hasrun = Task.SKIPPED
 				self.add_more_tasks(tsk)
+				self.mark_finished(tsk)
 
 				# shrinking sets
 				try:
@@ -159,7 +169,15 @@ if 1:
 						except KeyError:
 							pass
 
+			elif not self.acquire(tsk):
+				# the task is waiting for resources held by running tasks
+				continue
 			else:
+				if self.bld.jobs_auto:
+					self.adjust_jobs()
+					while self.count >= self.limit:
+						self.get_out()
+
 				# run me: put the task in ready queue
 				tsk.position = (self.processed, self.total)
 				self.count += 1
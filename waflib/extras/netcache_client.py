@@ -22,6 +22,9 @@ The cache can be enabled for the build only:
 		opt.load('netcache_client', funs=[])
 	def build(bld):
 		bld.setup_netcache('localhost', 51200, 'PUSH_PULL')
+
+The files are sent to the server while the next tasks are executed with:
+	waf build --cache-async=flush
 """
 
 import os, socket, time, atexit